@@ -0,0 +1,378 @@
+"""Замеры горячих путей монитора на синтетических данных.
+
+Все данные создаются во временном каталоге, реальные носители не нужны.
+Результаты пишутся в JSON, чтобы сравнивать их между коммитами:
+
+    python bench.py --files 1000,10000 --output bench.json
+    python bench.py --only scan,hash --files 1000000
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_drive_tree(root, n_files, seed=0, files_per_dir=100, big_every=1000):
+    """Создает дерево из n_files файлов разного размера.
+
+    Большинство файлов маленькие (до 4 КБ), каждый big_every-й — 1–8 МБ
+    (разреженный, чтобы генерация была быстрой).
+    """
+    rng = random.Random(seed)
+    for i in range(n_files):
+        directory = os.path.join(root, f"d{i // (files_per_dir * files_per_dir)}", f"s{i // files_per_dir}")
+        if i % files_per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"f{i}.bin")
+        with open(path, "wb") as file:
+            if big_every and i % big_every == big_every - 1:
+                file.truncate(rng.randint(1, 8) * 1024 * 1024)
+            else:
+                file.write(rng.randbytes(rng.randint(0, 4096)))
+    return root
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """Лучшее время из repeat запусков и результат последнего."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def import_in(workdir, module_name):
+    """Импортирует модуль репозитория с рабочим каталогом workdir.
+
+    main.py создает файлы данных в текущем каталоге при первом обращении.
+    """
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    sys.modules.pop(module_name, None)
+    return importlib.import_module(module_name)
+
+
+def bench_scan(workdir, tree, n_files):
+    main = import_in(workdir, "main")
+    seconds, count = timed(lambda: sum(1 for _ in main.scan_files_on_drive(tree)), repeat=3)
+    return {"seconds": seconds, "files": count, "files_per_sec": count / seconds}
+
+
+def bench_log_file_changes(workdir, tree, n_files):
+    main = import_in(workdir, "main")
+    main.WRITE_CHANGE_LOG = False
+    serial = f"BENCH{n_files}"
+    first, _ = timed(main.log_file_changes, serial, tree)
+    # Повторное подключение без изменений и с изменением 1% файлов
+    unchanged, _ = timed(main.log_file_changes, serial, tree)
+    added = [os.path.join(tree, f"new{i}.bin") for i in range(max(1, n_files // 100))]
+    for path in added:
+        with open(path, "wb") as file:
+            file.write(b"x")
+    changed, changes = timed(main.log_file_changes, serial, tree)
+    for path in added:
+        os.remove(path)
+    main.log_file_changes(serial, tree)
+    return {"first_seconds": first, "unchanged_seconds": unchanged, "changed_seconds": changed,
+            "new_files": len(changes["new_files"])}
+
+
+def bench_update_history(workdir, tree, n_files):
+    main = import_in(workdir, "main")
+    # Время записи не должно зависеть от числа уже сохраненных событий
+    results = {}
+    for batch in range(3):
+        seconds, _ = timed(lambda: [main.update_history(f"S{i % 50}", "подключен") for i in range(n_files)])
+        results[f"batch{batch}_events_per_sec"] = n_files / seconds
+    main.history_store.close()
+    return results
+
+
+def bench_hash(workdir, tree, n_files):
+    hashing = import_in(workdir, "hashing")
+    big = os.path.join(workdir, "big.bin")
+    with open(big, "wb") as file:
+        file.write(os.urandom(64 * 1024 * 1024))
+    seconds, _ = timed(hashing.hash_file, big, repeat=3)
+    cache = hashing.HashCache()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        cold, result = timed(cache.hash_tree, tree, executor)
+        warm, _ = timed(cache.hash_tree, tree, executor, repeat=3)
+    os.remove(big)
+    return {"hash_file_mb_per_sec": 64 / seconds, "tree_cold_seconds": cold,
+            "tree_warm_seconds": warm, "files": len(result)}
+
+
+def bench_log_event(workdir, tree, n_files):
+    main_flask = import_in(workdir, "main_flask")
+    main_flask.DB_PATH = os.path.join(workdir, f"events_{n_files}.db")
+    main_flask.init_db()
+    start = time.perf_counter()
+    for i in range(n_files):
+        main_flask.log_event("file_added", "E:", "Unknown", f"Файл добавлен: f{i}")
+    main_flask.get_event_writer().flush()
+    seconds = time.perf_counter() - start
+    main_flask.close_event_writer()
+    return {"seconds": seconds, "events_per_sec": n_files / seconds}
+
+
+def bench_api(workdir, tree, n_files):
+    from fastapi.testclient import TestClient
+
+    main_flask = import_in(workdir, "main_flask")
+    main_flask.DB_PATH = os.path.join(workdir, f"api_{n_files}.db")
+    main_flask.init_db()
+    rows = n_files * 10
+    with sqlite3.connect(main_flask.DB_PATH) as conn:
+        conn.executemany(
+            "INSERT INTO usb_events (timestamp, event_type, device, owner, file_changes) VALUES (?, ?, ?, ?, ?)",
+            ((f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:00:00",
+              ("connect", "disconnect", "file_added")[i % 3], f"D{i % 20}:", f"U{i % 7}", "x")
+             for i in range(rows)))
+    client = TestClient(main_flask.app)
+    latencies = {}
+    for name, path, params in (("index", "/", {}),
+                               ("filter_type", "/filter", {"event_type": "connect"}),
+                               ("filter_device_range", "/filter", {"device": "D3:", "since": "2025-03-01",
+                                                                   "until": "2025-04-01"})):
+        seconds, response = timed(client.get, path, params=params, repeat=5)
+        latencies[f"{name}_ms"] = seconds * 1000
+        cursor = response.json()["next_cursor"]
+        if cursor:
+            seconds, _ = timed(client.get, path, params={**params, "cursor": cursor}, repeat=5)
+            latencies[f"{name}_page2_ms"] = seconds * 1000
+    latencies["rows"] = rows
+    return latencies
+
+
+def bench_ingest(workdir, tree, n_files, agents=4):
+    """Несколько локальных агентов отправляют события на сборщик через HTTP.
+
+    Сборщик — настоящий uvicorn на localhost; у каждого агента своя база
+    с n_files * 10 событиями. После замера отметки агентов сбрасываются и
+    все события отправляются повторно: сборщик не должен принять ни одного.
+    """
+    import uvicorn
+
+    main_flask = import_in(workdir, "main_flask")
+    uploader = import_in(workdir, "uploader")
+    rows = n_files * 10
+    agent_dbs = []
+    for agent in range(agents):
+        main_flask.DB_PATH = os.path.join(workdir, f"agent{agent}.db")
+        main_flask.init_db()
+        with sqlite3.connect(main_flask.DB_PATH) as conn:
+            conn.executemany(
+                "INSERT INTO usb_events (timestamp, event_type, device, owner, file_changes) VALUES (?, ?, ?, ?, ?)",
+                ((f"2025-01-01 00:00:{i % 60:02d}", "file_added", "E:", f"U{agent}", f"Файл добавлен: f{i}")
+                 for i in range(rows)))
+        agent_dbs.append(main_flask.DB_PATH)
+
+    main_flask.DB_PATH = os.path.join(workdir, "collector.db")
+    main_flask.COLLECTOR_MODE = True
+    main_flask.MONITOR_ON_STARTUP = False
+    main_flask.COLLECTOR_URL = None
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main_flask.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def push_all():
+        # Один и тот же host у всех агентов: различаются только по agent_id
+        clients = [uploader.EventUploader(path, f"http://127.0.0.1:{port}", host="bench") for path in agent_dbs]
+
+        def drain(client):
+            while client.upload_once():
+                pass
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=drain, args=(client,)) for client in clients]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - start
+        for client in clients:
+            client.stop()
+        with sqlite3.connect(main_flask.DB_PATH) as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM usb_events").fetchone()[0]
+        return seconds, stored
+
+    try:
+        seconds, stored = push_all()
+        for path in agent_dbs:
+            with sqlite3.connect(path) as conn:
+                conn.execute("UPDATE upload_state SET last_id = 0")
+        resend_seconds, stored_after_resend = push_all()
+    finally:
+        server.should_exit = True
+        thread.join()
+    assert stored == stored_after_resend == rows * agents, (stored, stored_after_resend)
+    return {"agents": agents, "events": rows * agents, "seconds": seconds,
+            "events_per_sec": rows * agents / seconds, "resend_seconds": resend_seconds}
+
+
+def make_fixture_device(root, index):
+    name = f"sd{index}"
+    device = os.path.join(root, "sys", "devices", "usb1", f"1-{index}")
+    block = os.path.join(device, "block", name)
+    os.makedirs(os.path.join(block, f"{name}1"), exist_ok=True)
+    os.makedirs(os.path.join(device, "target"), exist_ok=True)
+    for path, value in ((os.path.join(device, "serial"), f"SER{index}"),
+                        (os.path.join(device, "target", "model"), f"Model {index}"),
+                        (os.path.join(block, "removable"), "1"),
+                        (os.path.join(block, "size"), "2048"),
+                        (os.path.join(block, f"{name}1", "partition"), "1")):
+        with open(path, "w") as file:
+            file.write(value)
+    if not os.path.islink(os.path.join(block, "device")):
+        os.symlink(os.path.join("..", "..", "target"), os.path.join(block, "device"))
+    return name, os.path.join("..", "devices", "usb1", f"1-{index}", "block", name)
+
+
+def bench_hotplug_storm(workdir, tree, n_files):
+    """Серия подключений и отключений в поддельном sysfs."""
+    drives = import_in(workdir, "drives")
+    root = os.path.join(workdir, f"sysfs_{n_files}")
+    os.makedirs(os.path.join(root, "sys", "block"), exist_ok=True)
+    os.makedirs(os.path.join(root, "proc"), exist_ok=True)
+    devices = [make_fixture_device(root, i) for i in range(32)]
+    mounts = os.path.join(root, "proc", "mounts")
+
+    def plug(indexes):
+        for i, (name, target) in enumerate(devices):
+            link = os.path.join(root, "sys", "block", name)
+            if i in indexes and not os.path.islink(link):
+                os.symlink(target, link)
+            elif i not in indexes and os.path.islink(link):
+                os.remove(link)
+        with open(mounts, "w") as file:
+            file.writelines(f"/dev/{devices[i][0]}1 /media/{i} vfat rw 0 0\n" for i in sorted(indexes))
+
+    backend = drives.FixtureBackend(root)
+    rng = random.Random(0)
+    storm = []
+    cycles = min(n_files, 2000)
+    for _ in range(cycles):
+        plugged = set(rng.sample(range(len(devices)), rng.randint(0, len(devices))))
+        plug(plugged)
+        seconds, result = timed(backend.enumerate)
+        assert len(result) == len(plugged)
+        storm.append(seconds)
+    idle, _ = timed(backend.enumerate, repeat=100)
+    return {"cycles": cycles, "changed_mean_us": sum(storm) / len(storm) * 1e6,
+            "changed_max_us": max(storm) * 1e6, "idle_us": idle * 1e6}
+
+
+def bench_cold_start(workdir, tree, n_files):
+    """Время запуска разовых команд cli.py в новом процессе.
+
+    Экспорт идет по пустой истории, сканирование — по уже известному
+    носителю без изменений, поэтому в замер почти не входит сама работа.
+    Для сравнения замеряется запуск пустого интерпретатора.
+    """
+    os.chdir(workdir)
+    cli = os.path.join(REPO_DIR, "cli.py")
+    drive = os.path.join(workdir, "drive")
+    os.makedirs(drive)
+    with open(os.path.join(drive, "file.txt"), "w") as file:
+        file.write("x")
+
+    def run(*args):
+        subprocess.run([sys.executable, *args], cwd=workdir, check=True, capture_output=True)
+
+    run(cli, "scan", drive, "--serial", "BENCH")
+    results = {}
+    for name, args in (("python_seconds", ["-c", "pass"]),
+                       ("export_csv_seconds", [cli, "export", "--format", "csv"]),
+                       ("export_html_seconds", [cli, "export", "--format", "html"]),
+                       ("scan_seconds", [cli, "scan", drive, "--serial", "BENCH"])):
+        results[name], _ = timed(run, *args, repeat=5)
+    return results
+
+
+BENCHMARKS = {
+    "scan": bench_scan,
+    "log_file_changes": bench_log_file_changes,
+    "update_history": bench_update_history,
+    "hash": bench_hash,
+    "log_event": bench_log_event,
+    "api": bench_api,
+    "ingest": bench_ingest,
+    "hotplug_storm": bench_hotplug_storm,
+    "cold_start": bench_cold_start,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры горячих путей монитора USB")
+    parser.add_argument("--files", default="1000,10000", help="размеры синтетических носителей через запятую")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="список замеров через запятую")
+    parser.add_argument("--output", default="bench.json", help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.files.split(",")]
+    names = args.only.split(",")
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": [],
+    }
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="usb_bench_")
+    try:
+        for n_files in sizes:
+            tree = make_drive_tree(os.path.join(workdir, f"drive_{n_files}"), n_files)
+            for name in names:
+                rundir = os.path.join(workdir, f"{name}_{n_files}")
+                os.makedirs(rundir)
+                try:
+                    metrics = BENCHMARKS[name](rundir, tree, n_files)
+                except ImportError as e:
+                    metrics = {"skipped": str(e)}
+                finally:
+                    os.chdir(cwd)
+                report["results"].append({"name": name, "files": n_files, **metrics})
+                print(json.dumps(report["results"][-1], ensure_ascii=False))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Единая точка входа монитора съемных носителей.
+
+    python cli.py monitor [--multiprocess]
+    python cli.py serve [--host H] [--port P] [--db FILE] [--collector] [--collector-url URL]
+    python cli.py export [--format xlsx|csv|parquet|html|summary] [--output FILE] ...
+    python cli.py scan PATH [--serial SERIAL]
+
+Модули подкоманд импортируются только при их вызове: экспорт и
+сканирование не загружают rich, keyboard, FastAPI и WMI.
+"""
+import argparse
+import sys
+
+
+def cmd_monitor(args):
+    if args.multiprocess:
+        import main_threading
+        main_threading.run()
+    else:
+        import main
+        main.run()
+
+
+def cmd_serve(args):
+    import main_flask
+    main_flask.run(host=args.host, port=args.port, db_path=args.db,
+                   collector=True if args.collector else None, collector_url=args.collector_url)
+
+
+def cmd_export(args):
+    import main
+    if args.format == "html":
+        message = main.export_to_timeline_html(since=args.since, until=args.until, split_by=args.split_by,
+                                               filename=args.output or "timeline.html")
+    elif args.format == "summary":
+        message = main.export_daily_summary(since=args.since, until=args.until,
+                                            filename=args.output or "сводка_по_дням.csv")
+    else:
+        if args.since or args.until:
+            sys.exit("--since и --until поддерживаются только для html и summary")
+        message = main.export_to_excel(fmt=args.format, incremental=args.incremental, filename=args.output)
+    print(message)
+
+
+def cmd_scan(args):
+    import main
+    serial = args.serial
+    if serial is None:
+        drives, _ = main.get_removable_drives(force=True)
+        serial = next((drive["SerialNumber"] for drive in drives if drive["Letter"] == args.path), None)
+        if serial is None:
+            sys.exit(f"{args.path} не найден среди съемных носителей, укажите --serial")
+    try:
+        file_changes = main.log_file_changes(serial, args.path)
+        if main.INDEX_FILE_CONTENTS:
+            main.index_drive_contents(serial, args.path)
+    finally:
+        main.close_data()
+    if file_changes is None:
+        print(f"{serial}: первое сканирование, сохранено исходное состояние")
+    else:
+        print(f"{serial}: добавлено {len(file_changes['new_files'])}, "
+              f"изменено {len(file_changes['modified_files'])}, удалено {len(file_changes['removed_files'])}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Монитор съемных носителей")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    monitor = subparsers.add_parser("monitor", help="консольный монитор с живой панелью")
+    monitor.add_argument("--multiprocess", action="store_true",
+                         help="опрос и отображение в отдельных процессах (main_threading)")
+    monitor.set_defaults(func=cmd_monitor)
+
+    serve = subparsers.add_parser("serve", help="веб-интерфейс и API")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=5000)
+    serve.add_argument("--db", help="база событий, по умолчанию usb_log.db")
+    serve.add_argument("--collector", action="store_true", help="режим сборщика: прием событий через /ingest")
+    serve.add_argument("--collector-url", help="адрес сборщика для отправки своих событий")
+    serve.set_defaults(func=cmd_serve)
+
+    export = subparsers.add_parser("export", help="разовый экспорт истории подключений")
+    export.add_argument("--format", default="xlsx", choices=["xlsx", "csv", "parquet", "html", "summary"])
+    export.add_argument("--output", help="имя файла результата")
+    export.add_argument("--since", help="начало диапазона, ГГГГ-ММ-ДД[ ЧЧ:ММ:СС]")
+    export.add_argument("--until", help="конец диапазона (не включая)")
+    export.add_argument("--split-by", choices=["day", "month", "year"], help="отдельный html-файл на период")
+    export.add_argument("--incremental", action="store_true", help="только события новее прошлого экспорта")
+    export.set_defaults(func=cmd_export)
+
+    scan = subparsers.add_parser("scan", help="разовое сканирование носителя")
+    scan.add_argument("path", help="буква диска или точка монтирования")
+    scan.add_argument("--serial", help="серийный номер; по умолчанию определяется по пути")
+    scan.set_defaults(func=cmd_scan)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
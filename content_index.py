@@ -0,0 +1,116 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import metrics
+from hashing import hash_file
+from sqlite_connections import ThreadConnections
+
+
+class ContentIndex:
+    """Глобальный индекс содержимого: хэш -> (носитель, путь, первое и последнее появление).
+
+    Таблица хранится в той же базе, что и манифест файлов: колонка hash
+    манифеста служит кэшем хэшей, поэтому файлы с прежними размером и mtime
+    не перечитываются, а хэш и запись индекса фиксируются одной транзакцией.
+    Поиск по хэшу идет по первичному ключу, по имени файла — по индексу.
+    """
+
+    def __init__(self, db_path="file_manifest.db"):
+        self.db_path = db_path
+        self._connections = ThreadConnections(db_path, setup=self._use_row_factory)
+        conn = self._connection()
+        conn.execute('''CREATE TABLE IF NOT EXISTS content_locations (
+            hash TEXT,
+            serial TEXT,
+            path TEXT,
+            name TEXT,
+            first_seen TEXT,
+            last_seen TEXT,
+            present INTEGER,
+            PRIMARY KEY (hash, serial, path)
+        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_content_name ON content_locations (name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_content_serial ON content_locations (serial, present)")
+
+    @staticmethod
+    def _use_row_factory(conn):
+        conn.row_factory = sqlite3.Row
+
+    def _connection(self):
+        return self._connections.get()
+
+    @metrics.timed("content_index_update")
+    def update(self, serial_number, root, cancel=None):
+        """Хэширует файлы носителя без хэша в манифесте и обновляет индекс.
+
+        Вызывается после FileManifest.update. Хэшируются только новые и
+        измененные файлы, а также оставшиеся от прерванного индексирования.
+        Если носитель извлекли, сохраняется уже посчитанная часть, остальное
+        хэшируется при следующем подключении.
+
+        :param root: текущий корень носителя; пути в манифесте относительные
+        :return: число прочитанных файлов
+        """
+        conn = self._connection()
+        paths = [row[0] for row in conn.execute(
+            "SELECT path FROM manifest WHERE serial = ? AND hash IS NULL", (serial_number,))]
+
+        hashed = []
+        for path in paths:
+            if cancel is not None and cancel.is_set():
+                break
+            try:
+                hashed.append((hash_file(os.path.join(root, path)), path))
+            except OSError:
+                # Файл удален или недоступен во время чтения
+                continue
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("UPDATE manifest SET hash = ? WHERE serial = ? AND path = ?",
+                             ((digest, serial_number, path) for digest, path in hashed))
+            conn.executemany(
+                "INSERT INTO content_locations VALUES (?, ?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT (hash, serial, path) DO UPDATE SET last_seen = excluded.last_seen, present = 1",
+                ((digest, serial_number, path, os.path.basename(path), now, now) for digest, path in hashed))
+            # Файлы, удаленные с носителя или изменившие содержимое
+            conn.execute(
+                "UPDATE content_locations SET present = 0 WHERE serial = ? AND present = 1 "
+                "AND NOT EXISTS (SELECT 1 FROM manifest m WHERE m.serial = content_locations.serial "
+                "AND m.path = content_locations.path AND m.hash = content_locations.hash)",
+                (serial_number,))
+            conn.execute("UPDATE content_locations SET last_seen = ? WHERE serial = ? AND present = 1",
+                         (now, serial_number))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        metrics.counter("content_index_hashed").inc(len(hashed))
+        return len(hashed)
+
+    def _find(self, column, value):
+        rows = self._connection().execute(
+            f"SELECT hash, serial, path, first_seen, last_seen, present FROM content_locations "
+            f"WHERE {column} = ? ORDER BY first_seen", (value,))
+        return [{
+            "hash": row["hash"],
+            "serial": row["serial"],
+            "path": row["path"],
+            "first_seen": row["first_seen"],
+            "last_seen": row["last_seen"],
+            "present": bool(row["present"])
+        } for row in rows]
+
+    def find_by_hash(self, digest):
+        """Все носители и пути, где встречалось содержимое с этим хэшем."""
+        return self._find("hash", digest.lower())
+
+    def find_by_name(self, name):
+        """Все носители и пути, где встречался файл с этим именем."""
+        return self._find("name", name)
+
+    def close(self):
+        self._connections.close()
@@ -0,0 +1,122 @@
+import threading
+from contextlib import contextmanager
+
+from rich.console import Group
+from rich.live import Live
+from rich.panel import Panel
+from rich.table import Table
+from rich.text import Text
+
+import metrics
+
+# Сколько путей показывать в ячейке изменений; остальные только считаются
+FILE_PREVIEW_LIMIT = 5
+
+
+def summarize_file_changes(file_changes, limit=FILE_PREVIEW_LIMIT):
+    """Краткая сводка изменений файлов: счетчики и не больше `limit` путей.
+
+    Стоимость не зависит от числа изменившихся файлов сверх `limit`.
+    """
+    file_changes = file_changes or {}
+    groups = (("Добавлен", file_changes.get("new_files") or []),
+              ("Изменен", file_changes.get("modified_files") or []),
+              ("Удален", file_changes.get("removed_files") or []))
+    total = sum(len(files) for _, files in groups)
+    if not total:
+        return "Нет изменений файлов"
+
+    lines = [f"Добавлено: {len(groups[0][1])}, изменено: {len(groups[1][1])}, удалено: {len(groups[2][1])}"]
+    shown = 0
+    for label, files in groups:
+        for file in files[:limit - shown]:
+            lines.append(f"{label}: {file}")
+            shown += 1
+    if total > shown:
+        lines.append(f"... и еще {total - shown}")
+    return "\n".join(lines)
+
+
+class Dashboard:
+    """Таблица устройств в rich.live с перерисовкой по таймеру.
+
+    Данные обновляются построчно через `set_rows`: неизменившиеся строки не
+    трогаются, таблица пересобирается из готовых ячеек только если что-то
+    изменилось. Экран перерисовывается `refresh_per_second` раз в секунду
+    независимо от частоты опроса устройств.
+    """
+
+    def __init__(self, console, title, columns, header=(), empty_message="Нет данных",
+                 refresh_per_second=4, **table_options):
+        self.console = console
+        self.title = title
+        self.columns = columns  # [(название, параметры add_column)]
+        self.header = list(header)
+        self.empty_message = empty_message
+        self._table_options = table_options
+        self._rows = {}  # ключ -> кортеж ячеек
+        self._lock = threading.Lock()
+        self._renderable = None
+        self._live = Live(console=console, get_renderable=self._render, auto_refresh=True,
+                          refresh_per_second=refresh_per_second, redirect_stdout=True, redirect_stderr=True)
+
+    def start(self):
+        self._live.start()
+
+    def stop(self):
+        self._live.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def suspended(self):
+        """Временно убирает панель, например на время ввода с клавиатуры."""
+        self._live.stop()
+        try:
+            yield
+        finally:
+            self._live.start()
+
+    def set_rows(self, rows):
+        """Заменяет строки таблицы.
+
+        :param rows: словарь {ключ: кортеж ячеек}; порядок строк — порядок ключей
+        :return: число изменившихся строк
+        """
+        with self._lock:
+            changed = sum(1 for key, cells in rows.items() if self._rows.get(key) != cells)
+            changed += len(self._rows.keys() - rows.keys())
+            if changed or list(rows) != list(self._rows):
+                self._rows = dict(rows)
+                self._renderable = None
+        return changed
+
+    def set_header(self, lines):
+        with self._lock:
+            if list(lines) != self.header:
+                self.header = list(lines)
+                self._renderable = None
+
+    def _render(self):
+        with self._lock:
+            if self._renderable is None:
+                with metrics.time_block("render"):
+                    self._renderable = self._build()
+            return self._renderable
+
+    def _build(self):
+        header = [Text.from_markup(line) for line in self.header]
+        if not self._rows:
+            return Group(*header, Panel(self.empty_message, style="red"))
+        table = Table(title=self.title, **self._table_options)
+        for name, options in self.columns:
+            table.add_column(name, **options)
+        for cells in self._rows.values():
+            # Пути файлов выводятся как есть, без разбора разметки rich
+            table.add_row(*(Text(cell) if isinstance(cell, str) else cell for cell in cells))
+        return Group(*header, table)
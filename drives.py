@@ -0,0 +1,339 @@
+import abc
+import hashlib
+import os
+import re
+import select
+import sys
+import time
+
+import metrics
+
+# Поля описания носителя; имена совпадают со свойствами Win32_DiskDrive
+DRIVE_FIELDS = [
+    "BytesPerSector", "Capabilities", "CapabilityDescriptions", "Caption",
+    "ConfigManagerErrorCode", "ConfigManagerUserConfig", "CreationClassName",
+    "Description", "DeviceID", "FirmwareRevision", "Index", "InterfaceType",
+    "Manufacturer", "MediaLoaded", "MediaType", "Model", "Name", "Partitions",
+    "PNPDeviceID", "SCSIBus", "SCSILogicalUnit", "SCSIPort", "SCSITargetId",
+    "SectorsPerTrack", "SerialNumber", "Signature", "Size", "Status",
+    "SystemCreationClassName", "SystemName", "TotalCylinders", "TotalHeads",
+    "TotalSectors", "TotalTracks", "TracksPerCylinder",
+]
+
+REMOVABLE_MEDIA_TYPES = ("Removable Media", "External hard disk media")
+
+
+class DriveBackend(abc.ABC):
+    """Источник списка съемных носителей.
+
+    `enumerate` возвращает список словарей с полями DRIVE_FIELDS и "Letter"
+    (буква диска или точка монтирования), по одному на смонтированный раздел.
+    `generation` увеличивается каждый раз, когда список меняется.
+    `probe` — дешевая проверка без перечисления: пока ее значение не
+    меняется, набор носителей считается прежним; None — проверки нет.
+    """
+
+    generation = 0
+
+    @abc.abstractmethod
+    def enumerate(self):
+        pass
+
+    def probe(self):
+        return None
+
+
+class WmiBackend(DriveBackend):
+    """Перечисление через WMI, только Windows.
+
+    Соединение с WMI создается один раз и переиспользуется между опросами.
+    """
+
+    def __init__(self):
+        import wmi
+        self._wmi = wmi.WMI()
+        self._last = None
+
+    def enumerate(self):
+        removable_drives = []
+        for drive in self._wmi.Win32_DiskDrive():
+            if drive.MediaType not in REMOVABLE_MEDIA_TYPES:
+                continue
+            for partition in drive.associators("Win32_DiskDriveToDiskPartition"):
+                for logical_disk in partition.associators("Win32_LogicalDiskToPartition"):
+                    drive_info = {field: getattr(drive, field) for field in DRIVE_FIELDS}
+                    drive_info["Letter"] = logical_disk.DeviceID
+                    removable_drives.append(drive_info)
+        if removable_drives != self._last:
+            self._last = removable_drives
+            self.generation += 1
+        return [dict(drive) for drive in removable_drives]
+
+    def probe(self):
+        # Битовая маска букв дисков, как в check.py: один системный вызов без WMI
+        from ctypes import windll
+        return windll.kernel32.GetLogicalDrives()
+
+
+class SysfsBackend(DriveBackend):
+    """Перечисление через /sys/block и таблицу монтирования, только Linux.
+
+    Атрибуты устройства читаются из sysfs только когда у него меняется
+    поколение: inode каталога в /sys/block (новый при повторном подключении)
+    и diskseq. Таблица монтирования перечитывается только после изменения.
+    Если ничего не изменилось, возвращается закэшированный результат.
+    """
+
+    def __init__(self, root="/", mounts_path=None):
+        self.root = root
+        self.block_dir = os.path.join(root, "sys", "block")
+        self.mounts_path = mounts_path or os.path.join(root, "proc", "self", "mounts")
+        self._devices = {}  # имя -> (поколение, атрибуты или None для несъемных)
+        self._mounts = {}
+        self._mounts_signature = None
+        self._mounts_poller = None
+        self._mounts_file = None
+        self._mounts_reads = 0
+        self._drives = []
+        self._watch_mounts()
+
+    def _watch_mounts(self):
+        # Для /proc изменения таблицы видны через poll(); для обычного файла — по mtime
+        if not self.mounts_path.startswith("/proc/") or not hasattr(select, "poll"):
+            return
+        try:
+            self._mounts_file = open(self.mounts_path, "r")
+        except OSError:
+            return
+        self._mounts_poller = select.poll()
+        self._mounts_poller.register(self._mounts_file, select.POLLERR | select.POLLPRI)
+
+    def _mounts_changed(self):
+        if self._mounts_poller is not None:
+            if self._mounts_signature is None:
+                self._mounts_signature = True
+                return True
+            return bool(self._mounts_poller.poll(0))
+        try:
+            stat = os.stat(self.mounts_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        if signature == self._mounts_signature:
+            return False
+        self._mounts_signature = signature
+        return True
+
+    def _mounts_probe(self):
+        if self._mounts_poller is not None:
+            # poll() не сбрасывает событие, его сбрасывает только чтение таблицы;
+            # номер чтения отличает новое событие от уже обработанного
+            pending = bool(self._mounts_poller.poll(0)) or self._mounts_signature is None
+            return self._mounts_reads, pending
+        try:
+            stat = os.stat(self.mounts_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def probe(self):
+        try:
+            names = tuple(sorted(os.listdir(self.block_dir)))
+        except OSError:
+            names = ()
+        return names, self._mounts_probe()
+
+    def _read_mounts(self):
+        self._mounts_reads += 1
+        if self._mounts_file is not None:
+            self._mounts_file.seek(0)
+            lines = self._mounts_file.read().splitlines()
+        else:
+            try:
+                with open(self.mounts_path, "r") as file:
+                    lines = file.read().splitlines()
+            except OSError:
+                lines = []
+        mounts = {}
+        for line in lines:
+            fields = line.split()
+            if len(fields) >= 2 and fields[0].startswith("/dev/"):
+                # Пробелы в точках монтирования записаны как \040
+                mounts.setdefault(fields[0], re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), fields[1]))
+        return mounts
+
+    def _read(self, *parts):
+        try:
+            with open(os.path.join(*parts), "r") as file:
+                return file.read().strip()
+        except OSError:
+            return None
+
+    def _generation(self, name, entry):
+        return (entry.inode(), self._read(self.block_dir, name, "diskseq"))
+
+    def _usb_serial(self, device_dir):
+        """Ищет серийный номер USB-устройства вверх по дереву sysfs."""
+        path = os.path.realpath(os.path.join(device_dir, "device"))
+        stop = os.path.realpath(os.path.join(self.root, "sys"))
+        while path.startswith(stop) and path != stop:
+            serial = self._read(path, "serial")
+            if serial:
+                return serial, "/usb" in path
+            path = os.path.dirname(path)
+        return None, "/usb" in os.path.realpath(os.path.join(device_dir, "device"))
+
+    def _read_device(self, name):
+        device_dir = os.path.join(self.block_dir, name)
+        removable = self._read(device_dir, "removable") == "1"
+        serial, usb = self._usb_serial(device_dir)
+        if not removable and not usb:
+            return None
+
+        size = self._read(device_dir, "size")
+        model = self._read(device_dir, "device", "model")
+        partitions = sorted(
+            entry.name for entry in os.scandir(device_dir)
+            if entry.name.startswith(name) and os.path.exists(os.path.join(entry.path, "partition"))
+        )
+        info = dict.fromkeys(DRIVE_FIELDS)
+        info.update({
+            "Caption": model,
+            "Model": model,
+            "Manufacturer": self._read(device_dir, "device", "vendor"),
+            "FirmwareRevision": self._read(device_dir, "device", "rev"),
+            "DeviceID": f"/dev/{name}",
+            "Name": f"/dev/{name}",
+            "InterfaceType": "USB" if usb else None,
+            "MediaType": "Removable Media" if removable else "External hard disk media",
+            "MediaLoaded": size not in (None, "0"),
+            "SerialNumber": serial or name,
+            "Size": int(size) * 512 if size else None,
+            "TotalSectors": int(size) if size else None,
+            "BytesPerSector": 512,
+            "Partitions": len(partitions),
+            "Status": "OK",
+        })
+        return info, partitions
+
+    def enumerate(self):
+        changed = False
+        seen = set()
+        try:
+            entries = list(os.scandir(self.block_dir))
+        except OSError:
+            entries = []
+        for entry in entries:
+            name = entry.name
+            seen.add(name)
+            generation = self._generation(name, entry)
+            cached = self._devices.get(name)
+            if cached is not None and cached[0] == generation:
+                continue
+            self._devices[name] = (generation, self._read_device(name))
+            changed = True
+        for name in self._devices.keys() - seen:
+            del self._devices[name]
+            changed = True
+
+        if self._mounts_changed():
+            mounts = self._read_mounts()
+            if mounts != self._mounts:
+                self._mounts = mounts
+                changed = True
+
+        if changed:
+            drives = []
+            for name, (_, device) in sorted(self._devices.items()):
+                if device is None:
+                    continue
+                info, partitions = device
+                for node in [f"/dev/{part}" for part in partitions] or [info["DeviceID"]]:
+                    if node in self._mounts:
+                        drive_info = dict(info)
+                        drive_info["Letter"] = self._mounts[node]
+                        drives.append(drive_info)
+            if drives != self._drives:
+                self._drives = drives
+                self.generation += 1
+        return [dict(drive) for drive in self._drives]
+
+
+class FixtureBackend(SysfsBackend):
+    """SysfsBackend поверх каталога с поддельным деревом для проверок.
+
+    Ожидается структура <root>/sys/block/<имя>/... и таблица монтирования
+    в <root>/proc/mounts.
+    """
+
+    def __init__(self, root):
+        super().__init__(root, os.path.join(root, "proc", "mounts"))
+
+
+def drives_fingerprint(drives):
+    """Отпечаток набора носителей, одинаковый в разных процессах и после перезапуска.
+
+    Зависит только от моделей и серийных номеров, не от порядка перечисления.
+    """
+    digest = hashlib.sha1()
+    for model, serial in sorted((str(drive["Model"]), str(drive["SerialNumber"])) for drive in drives):
+        digest.update(f"{model}\0{serial}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class GatedEnumerator:
+    """Двухуровневое обнаружение: дешевая проверка перед полным перечислением.
+
+    Полное перечисление выполняется, только если изменилось значение
+    `backend.probe()`, вызывающий явно попросил (событие hotplug) или
+    прошло `safety_interval` секунд с последнего перечисления. Иначе
+    возвращается прошлый результат.
+    """
+
+    def __init__(self, backend, safety_interval=30):
+        self.backend = backend
+        self.safety_interval = safety_interval
+        self._probe = None
+        self._drives = None
+        self._fingerprint = None
+        self._enumerated_at = 0.0
+
+    def probe(self):
+        """Дешевое значение для PollingSource; без проверки у бэкенда — отпечаток."""
+        token = self.backend.probe()
+        if token is None:
+            return self.poll(force=True)[1]
+        return token
+
+    def poll(self, force=False):
+        """:return: (список носителей, отпечаток)"""
+        token = self.backend.probe()
+        stale = time.monotonic() - self._enumerated_at >= self.safety_interval
+        if self._drives is None or force or stale or token is None or token != self._probe:
+            with metrics.time_block("drive_enumerate"):
+                self._drives = self.backend.enumerate()
+            self._fingerprint = drives_fingerprint(self._drives)
+            self._probe = token
+            self._enumerated_at = time.monotonic()
+        else:
+            metrics.counter("drive_probe_skips").inc()
+        return [dict(drive) for drive in self._drives], self._fingerprint
+
+
+def init_backend_thread():
+    """Подготавливает поток, в котором создается и опрашивается бэкенд.
+
+    WmiBackend работает через COM, а COM нужно инициализировать в каждом
+    потоке; бэкенд используется только из того потока, где создан.
+    """
+    if os.name == "nt":
+        import pythoncom
+        pythoncom.CoInitialize()
+
+
+def default_backend():
+    if os.name == "nt":
+        return WmiBackend()
+    if sys.platform.startswith("linux"):
+        return SysfsBackend()
+    raise RuntimeError(f"Нет способа перечислить носители на платформе {sys.platform}")
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import metrics
+
+
+class Subscriber:
+    """Очередь событий одного клиента.
+
+    Очередь ограничена: если клиент не успевает читать, самые старые
+    события отбрасываются, а их число копится в `dropped`.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class EventStream:
+    """Рассылка событий всем подписчикам внутри процесса приложения.
+
+    `publish` можно вызывать из любого потока: доставка выполняется в
+    цикле событий, к которому поток привязан через `attach`.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._subscribers = set()
+        self._loop = None
+        self._loop_thread = None
+
+    def attach(self, loop):
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+    def detach(self):
+        self._loop = None
+
+    def subscribe(self):
+        subscriber = Subscriber(self.maxsize)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._deliver(event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event):
+        for subscriber in self._subscribers:
+            if subscriber.queue.full():
+                # Медленный клиент: освобождаем место за счет самого старого события
+                subscriber.queue.get_nowait()
+                subscriber.dropped += 1
+                metrics.counter("stream_events_dropped").inc()
+            subscriber.queue.put_nowait(event)
@@ -0,0 +1,120 @@
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+_STOP = object()
+
+
+class EventWriter:
+    """Фоновая запись событий в SQLite пачками.
+
+    Одно долгоживущее соединение в режиме WAL; события копятся в очереди и
+    фиксируются одной транзакцией, когда набралось `batch_size` строк или
+    прошло `flush_interval` секунд с первого события пачки. Читатели в
+    режиме WAL писателя не блокируют.
+
+    Если база занята другим процессом (загрузчик, прием /ingest), пачка не
+    теряется: запись повторяется с растущим интервалом, а новые события
+    ждут в очереди. При остановке повторы ограничены `close_timeout`.
+    """
+
+    def __init__(self, db_path, table, columns, batch_size=1000, flush_interval=0.2,
+                 min_backoff=0.05, max_backoff=5.0, close_timeout=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.close_timeout = close_timeout
+        self._sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(columns), ", ".join("?" * len(columns)))
+        self._queue = queue.Queue()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL не теряет целостность, но не делает fsync на каждый commit
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        """Ставит строку в очередь на запись; не блокируется на диске."""
+        self._queue.put(row)
+
+    def flush(self):
+        """Ждет, пока все поставленные в очередь строки будут записаны."""
+        self._queue.join()
+
+    def close(self):
+        """Записывает остаток очереди и закрывает соединение."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._conn.close()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert_rows(self, rows):
+        """Записывает строки по одной, пропуская те, что база не принимает."""
+        written = 0
+        for row in rows:
+            try:
+                with self._conn:
+                    self._conn.execute(self._sql, row)
+                written += 1
+            except (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+                metrics.counter("events_rejected").inc()
+                print(f"Событие не записано: {e}: {row!r}")
+        return written
+
+    def _write(self, rows, stopping):
+        """Записывает пачку, повторяя попытки, пока база занята или недоступна."""
+        backoff = self.min_backoff
+        deadline = time.monotonic() + self.close_timeout if stopping else None
+        while True:
+            try:
+                with metrics.time_block("event_writer_commit"), self._conn:
+                    self._conn.executemany(self._sql, rows)
+                return len(rows)
+            except (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError):
+                # Повтор не поможет: ищем строки, которые база не принимает
+                return self._insert_rows(rows)
+            except sqlite3.Error as e:
+                # database is locked, disk I/O error и т.п. — временные ошибки
+                metrics.counter("event_writer_retries").inc()
+                if deadline is not None and time.monotonic() + backoff > deadline:
+                    metrics.counter("events_lost").inc(len(rows))
+                    print(f"События не записаны при остановке ({len(rows)} шт.): {e}")
+                    return 0
+                print(f"Не удалось записать события, повтор через {backoff:.2f} с.: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            rows = batch[:-1] if stop else batch
+            if rows:
+                metrics.counter("events_written").inc(self._write(rows, stop))
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
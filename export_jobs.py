@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+
+import metrics
+
+_STOP = object()
+
+
+class ExportQueue:
+    """Очередь экспортов с одним фоновым исполнителем.
+
+    Повторный запрос экспорта, который еще ждет в очереди, не добавляет
+    новую задачу. Запрос во время выполнения ставит один повторный запуск:
+    данные могли измениться после начала экспорта. Ход и результат задач
+    видны через `status_lines` и передаются в `on_update`.
+    """
+
+    def __init__(self, jobs, on_update=None):
+        """:param jobs: словарь {вид: (название, функция(progress) -> сообщение)}"""
+        self._jobs = jobs
+        self._on_update = on_update
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._status = {}  # вид -> строка состояния
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="export")
+        self._thread.start()
+
+    def request(self, kind):
+        """Ставит экспорт в очередь; не блокируется.
+
+        :return: False, если такой экспорт уже ждет в очереди
+        """
+        with self._lock:
+            if kind in self._pending:
+                metrics.counter("export_requests_coalesced").inc()
+                return False
+            self._pending.add(kind)
+        self._set_status(kind, "в очереди")
+        self._queue.put(kind)
+        return True
+
+    def status_lines(self):
+        with self._lock:
+            return [f"{self._jobs[kind][0]}: {status}" for kind, status in self._status.items()]
+
+    def _set_status(self, kind, status, final=False):
+        with self._lock:
+            self._status[kind] = status
+        if self._on_update is not None:
+            self._on_update(kind, status, final)
+
+    def _run(self):
+        while True:
+            kind = self._queue.get()
+            if kind is _STOP:
+                return
+            with self._lock:
+                self._pending.discard(kind)
+            title, func = self._jobs[kind]
+            self._set_status(kind, "выполняется")
+            start = time.perf_counter()
+
+            def progress(count, kind=kind):
+                self._set_status(kind, f"выполняется, записей: {count}")
+
+            try:
+                with metrics.time_block(f"export_job_{kind}"):
+                    message = func(progress)
+                self._set_status(kind, f"готово за {time.perf_counter() - start:.1f} с. {message}", final=True)
+            except Exception as e:
+                self._set_status(kind, f"ошибка: {e}", final=True)
+
+    def close(self, timeout=None):
+        """Останавливает исполнитель: ждущие экспорты отменяются, текущий дожидается.
+
+        :param timeout: сколько секунд ждать текущий экспорт; None — без ограничения
+        :return: False, если экспорт не успел завершиться (поток исполнителя
+            фоновый и не задерживает выход из программы)
+        """
+        dropped = []
+        with self._lock:
+            while True:
+                try:
+                    kind = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                dropped.append(kind)
+                self._pending.discard(kind)
+        for kind in dropped:
+            self._set_status(kind, "отменен", final=True)
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
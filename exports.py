@@ -0,0 +1,311 @@
+import csv
+import html
+import json
+import os
+from datetime import datetime
+
+TIMELINE_HEADER = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Timeline of USB Connections</title>
+    <style>
+        /* Ваши стили для timeline */
+    </style>
+</head>
+<body>
+    <div class="timeline">
+"""
+
+TIMELINE_FOOTER = """    </div>
+</body>
+</html>
+"""
+
+# Длина префикса метки времени "ГГГГ-ММ-ДД ЧЧ:ММ:СС" для разбиения по периодам
+SPLIT_PREFIX = {"day": 10, "month": 7, "year": 4}
+
+# Через сколько событий сообщать о ходе экспорта
+PROGRESS_EVERY = 1000
+
+
+def iter_events(history, since=None, until=None, archive=None, progress=None, after=None):
+    """Перебирает события истории в диапазоне [since, until) по меткам времени.
+
+    :param archive: HistoryArchive; его сегменты читаются, только если
+        пересекаются с диапазоном
+    :param progress: функция(число событий), вызывается каждые PROGRESS_EVERY событий
+    :param after: отметка (seq, метка времени) прошлого экспорта: только
+        события, добавленные после нее; since и until тогда не используются
+    """
+    events = _iter_events(history, since, until, archive) if after is None else _iter_new_events(
+        history, archive, *after)
+    if progress is None:
+        yield from events
+        return
+    for count, item in enumerate(events, 1):
+        if count % PROGRESS_EVERY == 0:
+            progress(count)
+        yield item
+
+
+def _iter_events(history, since, until, archive):
+    if archive is not None:
+        yield from archive.iter_events(since, until)
+    for serial_number, events in history.items():
+        for event in events:
+            timestamp = event["timestamp"]
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp >= until:
+                continue
+            yield serial_number, event
+
+
+def _iter_new_events(history, archive, seq, since):
+    # События без seq записаны старой версией и отбираются по метке времени
+    if archive is not None:
+        yield from archive.iter_events_after(seq, since)
+    for serial_number, events in history.items():
+        for event in events:
+            if "seq" in event:
+                if event["seq"] > seq:
+                    yield serial_number, event
+            elif since is not None and event["timestamp"] >= since:
+                yield serial_number, event
+
+
+def last_seq(history, archive=None):
+    """Наибольший seq среди событий истории и архива."""
+    result = max((event.get("seq", 0) for events in history.values() for event in events), default=0)
+    if archive is not None:
+        result = max(result, archive.last_seq)
+    return result
+
+
+def _timeline_entry(serial_number, owner, event):
+    esc = html.escape
+    event_type = event["event"]
+    file_changes = event.get("file_changes") or {}
+    items = "".join(
+        f"<li>{label}: {esc(file)}</li>"
+        for label, key in (("Добавлен", "new_files"), ("Изменен", "modified_files"), ("Удален", "removed_files"))
+        for file in file_changes.get(key, [])
+    )
+    return f"""        <div class="container {'left' if event_type == 'подключен' else 'right'}">
+            <div class="content">
+                <h2>{esc(event["timestamp"])}</h2>
+                <p><strong>Владелец:</strong> {esc(str(owner))}</p>
+                <p><strong>Серийный номер:</strong> {esc(serial_number)}</p>
+                <p><strong>Событие:</strong> {esc(event_type)}</p>
+                <p><strong>Изменения файлов:</strong></p>
+                <ul>{items}</ul>
+            </div>
+        </div>
+"""
+
+
+def export_to_timeline_html(history, owners, filename="timeline.html", since=None, until=None, split_by=None,
+                            archive=None, progress=None):
+    """Пишет временную линию подключений в HTML потоком, событие за событием.
+
+    :param owners: словарь {серийный номер: владелец}, загруженный один раз на экспорт
+    :param since, until: необязательный диапазон [since, until) меток времени
+    :param split_by: "day", "month" или "year" — отдельный файл на каждый период,
+        например timeline_2025-02.html
+    :return: список записанных файлов
+    """
+    files = {}
+    base, ext = os.path.splitext(filename)
+    try:
+        for serial_number, event in iter_events(history, since, until, archive, progress):
+            period = event["timestamp"][:SPLIT_PREFIX[split_by]] if split_by else None
+            file = files.get(period)
+            if file is None:
+                path = f"{base}_{period}{ext}" if period else filename
+                file = files[period] = open(path, "w", encoding="utf-8")
+                file.write(TIMELINE_HEADER)
+            file.write(_timeline_entry(serial_number, owners.get(serial_number), event))
+        if not files:
+            # Пустая история: все равно создаем корректный документ
+            files[None] = open(filename, "w", encoding="utf-8")
+            files[None].write(TIMELINE_HEADER)
+    finally:
+        for file in files.values():
+            file.write(TIMELINE_FOOTER)
+            file.close()
+    return [file.name for file in files.values()]
+
+
+HISTORY_COLUMNS = ["Владелец", "Серийный номер", "Событие", "Время",
+                   "Добавленные файлы", "Измененные файлы", "Удаленные файлы"]
+
+# Сколько строк за раз передается в Parquet
+PARQUET_BATCH = 65536
+
+
+def history_rows(history, owners, since=None, until=None, archive=None, progress=None, after=None):
+    """Строки таблицы истории в порядке HISTORY_COLUMNS."""
+    for serial_number, event in iter_events(history, since, until, archive, progress, after):
+        file_changes = event.get("file_changes") or {}
+        yield (
+            owners.get(serial_number),
+            serial_number,
+            event["event"],
+            event["timestamp"],
+            ", ".join(file_changes.get("new_files", [])),
+            ", ".join(file_changes.get("modified_files", [])),
+            ", ".join(file_changes.get("removed_files", [])),
+        )
+
+
+def read_high_water_mark(filename):
+    """Отметка прошлого экспорта: (seq, метка времени) или None.
+
+    Старый формат — только метка времени; он читается как (0, метка).
+    """
+    try:
+        with open(filename + ".hwm", "r", encoding="utf-8") as file:
+            content = file.read().strip()
+    except FileNotFoundError:
+        return None
+    if not content:
+        return None
+    if content.startswith("{"):
+        mark = json.loads(content)
+        return mark["seq"], mark["timestamp"]
+    return 0, content
+
+
+def write_high_water_mark(filename, seq, timestamp):
+    with open(filename + ".hwm", "w", encoding="utf-8") as file:
+        json.dump({"seq": seq, "timestamp": timestamp}, file)
+
+
+def export_history(history, owners, filename, fmt=None, incremental=False, archive=None, progress=None):
+    """Экспортирует историю в xlsx, csv или parquet одним проходом.
+
+    В инкрементальном режиме выгружаются только события, добавленные в
+    историю после прошлого экспорта (файл <filename>.hwm): csv
+    дописывается, для xlsx и parquet создается отдельный файл с новыми
+    событиями. Отметка — номер добавления seq, а не время: подключение
+    записывается после сканирования с более ранним временем обнаружения
+    и по метке времени было бы пропущено.
+
+    :param fmt: "xlsx", "csv" или "parquet"; по умолчанию — по расширению файла
+    :return: (путь к записанному файлу, число строк)
+    """
+    base, ext = os.path.splitext(filename)
+    fmt = fmt or ext.lstrip(".")
+    mark = read_high_water_mark(filename) if incremental else None
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Отметка считается по тому же снимку истории, что и выгрузка
+    seq = max(last_seq(history, archive), mark[0] if mark else 0)
+    rows = history_rows(history, owners, archive=archive, progress=progress, after=mark)
+
+    path = filename
+    if mark is not None and fmt != "csv":
+        path = f"{base}_{now.replace('-', '').replace(' ', '').replace(':', '')}{ext}"
+
+    if fmt == "xlsx":
+        count = _write_xlsx(path, owners, rows)
+    elif fmt == "csv":
+        count = _write_csv(path, rows, append=mark is not None)
+    elif fmt == "parquet":
+        count = _write_parquet(path, rows)
+    else:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+    write_high_water_mark(filename, seq, now)
+    return path, count
+
+
+SUMMARY_COLUMNS = ["Владелец", "Серийный номер", "День", "Подключений", "Отключений",
+                   "Добавлено файлов", "Изменено файлов", "Удалено файлов"]
+
+
+def export_daily_summary(history, owners, filename, since=None, until=None, archive=None):
+    """Пишет в csv дневные сводки по носителям за дни [since, until).
+
+    Для архива берутся готовые сводки, в том числе за месяцы, подробности
+    которых уже удалены; недавняя история сворачивается на лету.
+
+    :return: число строк
+    """
+    from history_archive import rollup_events
+
+    rollups = archive.daily_summaries(since, until) if archive is not None else {}
+    recent = rollup_events(iter_events(history, since[:10] if since else None, until[:10] if until else None))
+    for serial_number, days in recent.items():
+        for day, summary in days.items():
+            # День на границе срока хранения может быть и в архиве, и в памяти
+            total = rollups.setdefault(serial_number, {}).setdefault(day, {})
+            for key, value in summary.items():
+                total[key] = total.get(key, 0) + value
+
+    count = 0
+    with open(filename, "w", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(SUMMARY_COLUMNS)
+        for serial_number in sorted(rollups):
+            for day, summary in sorted(rollups[serial_number].items()):
+                writer.writerow([owners.get(serial_number), serial_number, day,
+                                 summary.get("подключен", 0), summary.get("отключен", 0),
+                                 summary.get("new_files", 0), summary.get("modified_files", 0),
+                                 summary.get("removed_files", 0)])
+                count += 1
+    return count
+
+
+def _write_xlsx(path, owners, rows):
+    from openpyxl import Workbook
+
+    # Режим write_only пишет строки сразу во временные файлы, а не держит лист в памяти
+    workbook = Workbook(write_only=True)
+    owners_sheet = workbook.create_sheet("Владельцы")
+    owners_sheet.append(["Серийный номер", "Владелец"])
+    for serial_number, owner in owners.items():
+        owners_sheet.append([serial_number, owner])
+
+    history_sheet = workbook.create_sheet("История подключений")
+    history_sheet.append(HISTORY_COLUMNS)
+    count = 0
+    for row in rows:
+        history_sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def _write_csv(path, rows, append=False):
+    count = 0
+    # utf-8-sig, чтобы Excel правильно открыл кириллицу
+    with open(path, "a" if append else "w", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file)
+        if not append or file.tell() == 0:
+            writer.writerow(HISTORY_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_parquet(path, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.string()) for name in HISTORY_COLUMNS])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        columns = [[] for _ in HISTORY_COLUMNS]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+            count += 1
+            if len(columns[0]) >= PARQUET_BATCH:
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                columns = [[] for _ in HISTORY_COLUMNS]
+        if columns[0] or not count:
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+    return count
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+
+import metrics
+from walker import walk_files
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@metrics.timed("hash_file")
+def hash_file(filepath, chunk_size=CHUNK_SIZE):
+    """Считает MD5 файла, читая его блоками фиксированного размера."""
+    hasher = hashlib.md5()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+class HashCache:
+    """Кэш хэшей файлов с ключом (inode, размер, mtime_ns).
+
+    Файл перечитывается только если изменился хотя бы один элемент ключа.
+    """
+
+    def __init__(self):
+        self._entries = {}  # путь -> ((st_ino, st_size, st_mtime_ns), хэш)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(stat):
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, filepath, stat):
+        with self._lock:
+            entry = self._entries.get(filepath)
+        if entry is not None and entry[0] == self.key(stat):
+            return entry[1]
+        return None
+
+    def put(self, filepath, stat, digest):
+        with self._lock:
+            self._entries[filepath] = (self.key(stat), digest)
+
+    def retain(self, filepaths):
+        """Удаляет из кэша файлы, которых больше нет на носителе."""
+        with self._lock:
+            for filepath in self._entries.keys() - filepaths:
+                del self._entries[filepath]
+
+    def hash_tree(self, root, executor, cancel=None):
+        """Возвращает {относительный путь: хэш} для всех файлов в дереве.
+
+        Неизмененные файлы берутся из кэша, остальные хэшируются
+        параллельно в переданном пуле потоков.
+
+        :raises ScanCancelled: если носитель извлечен во время обхода
+        """
+        result = {}
+        pending = {}
+        seen = set()
+        for filepath, stat in walk_files(root, cancel=cancel):
+            relpath = os.path.relpath(filepath, root)
+            seen.add(filepath)
+            digest = self.get(filepath, stat)
+            if digest is not None:
+                result[relpath] = digest
+            else:
+                pending[relpath] = (filepath, stat, executor.submit(hash_file, filepath))
+
+        for relpath, (filepath, stat, future) in pending.items():
+            try:
+                digest = future.result()
+            except OSError:
+                # Файл удален или недоступен во время чтения
+                continue
+            self.put(filepath, stat, digest)
+            result[relpath] = digest
+
+        self.retain(seen)
+        metrics.counter("hash_cache_hits").inc(len(seen) - len(pending))
+        metrics.counter("hash_cache_misses").inc(len(pending))
+        return result
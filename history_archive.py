@@ -0,0 +1,230 @@
+import glob
+import gzip
+import io
+import json
+import os
+import shutil
+from datetime import datetime
+
+from history_store import _write_atomic
+
+# Длина префикса метки времени "ГГГГ-ММ-ДД ЧЧ:ММ:СС": месяц сегмента и день сводки
+MONTH_PREFIX = 7
+DAY_PREFIX = 10
+
+
+def rollup_events(events, rollups=None):
+    """Сворачивает события в дневные сводки по носителям.
+
+    :param events: итерируемый набор (серийный номер, событие)
+    :param rollups: словарь {серийный номер: {день: сводка}}, который дополняется
+    :return: тот же словарь
+    """
+    if rollups is None:
+        rollups = {}
+    for serial_number, event in events:
+        day = event["timestamp"][:DAY_PREFIX]
+        summary = rollups.setdefault(serial_number, {}).setdefault(day, {
+            "подключен": 0, "отключен": 0, "new_files": 0, "modified_files": 0, "removed_files": 0})
+        summary[event["event"]] = summary.get(event["event"], 0) + 1
+        file_changes = event.get("file_changes") or {}
+        for key in ("new_files", "modified_files", "removed_files"):
+            summary[key] += len(file_changes.get(key, []))
+    return rollups
+
+
+class HistoryArchive:
+    """Архив старой истории подключений: сжатые сегменты по месяцам.
+
+    События месяца дописываются в сегмент ГГГГ-ММ.jsonl.gz. При запуске
+    архив не читается: сегмент открывается только когда экспорт или запрос
+    затрагивает его месяц. Когда истекает срок хранения подробностей,
+    сегмент заменяется дневными сводками по носителям ГГГГ-ММ.rollup.json.
+
+    В state.json хранится отметка archived_until, подтвержденный размер
+    каждого сегмента и наибольший seq его событий (для инкрементального
+    экспорта). Читатели видят только подтвержденную часть, поэтому
+    архив можно читать из другого процесса во время записи; хвост,
+    дописанный прерванной записью, отрезается перед следующей записью.
+    """
+
+    def __init__(self, directory="history_archive"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._state_path = os.path.join(directory, "state.json")
+        self._state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"archived_until": None, "sizes": {}, "seqs": {}}
+
+    def _segment_path(self, month):
+        return os.path.join(self.directory, f"{month}.jsonl.gz")
+
+    def _rollup_path(self, month):
+        return os.path.join(self.directory, f"{month}.rollup.json")
+
+    def _recover(self):
+        sizes = self._state["sizes"]
+        for path in glob.glob(os.path.join(self.directory, "*.jsonl.gz")):
+            month = os.path.basename(path)[:MONTH_PREFIX]
+            committed = sizes.get(month)
+            if committed is None:
+                os.remove(path)
+            elif os.path.getsize(path) > committed:
+                with open(path, "r+b") as file:
+                    file.truncate(committed)
+
+    @property
+    def archived_until(self):
+        """Метка времени, раньше которой все события уже перенесены в архив."""
+        return self._state["archived_until"]
+
+    @property
+    def last_seq(self):
+        """Наибольший seq среди перенесенных в архив событий, 0 — если их нет."""
+        return max(self._state.get("seqs", {}).values(), default=0)
+
+    def archive(self, events, until):
+        """Дописывает события в сегменты их месяцев.
+
+        :param events: список (серийный номер, событие) с метками времени раньше until
+        """
+        self._recover()
+        by_month = {}
+        for serial_number, event in events:
+            by_month.setdefault(event["timestamp"][:MONTH_PREFIX], []).append((serial_number, event))
+
+        sizes = dict(self._state["sizes"])
+        seqs = dict(self._state.get("seqs", {}))
+        for month, month_events in by_month.items():
+            seqs[month] = max([seqs.get(month, 0)] + [event.get("seq", 0) for _, event in month_events])
+            path = self._segment_path(month)
+            # gzip допускает дописывание: каждая запись добавляет отдельный member
+            with open(path, "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as file:
+                    for serial_number, event in month_events:
+                        file.write((json.dumps({"serial": serial_number, **event}, ensure_ascii=False)
+                                    + "\n").encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+                sizes[month] = raw.tell()
+
+        self._commit({"archived_until": until, "sizes": sizes, "seqs": seqs})
+
+    def _commit(self, state):
+        _write_atomic(self._state_path, state)
+        self._state = state
+
+    def expire_details(self, before):
+        """Сворачивает в дневные сводки сегменты месяцев, целиком лежащих раньше before."""
+        sizes = dict(self._state["sizes"])
+        expired = [month for month in sizes if month < before[:MONTH_PREFIX]]
+        for month in expired:
+            if not os.path.exists(self._rollup_path(month)):
+                _write_atomic(self._rollup_path(month), rollup_events(self._read_segment(month, sizes)))
+            del sizes[month]
+        if expired:
+            self._commit({**self._state, "sizes": sizes})
+            for month in expired:
+                os.remove(self._segment_path(month))
+
+    def _months(self, months, since=None, until=None):
+        for month in sorted(months):
+            if since is not None and month < since[:MONTH_PREFIX]:
+                continue
+            if until is not None and month > until[:MONTH_PREFIX]:
+                continue
+            yield month
+
+    def _read_segment(self, month, sizes):
+        # Читается только подтвержденная часть: в конец сегмента может идти запись
+        try:
+            with open(self._segment_path(month), "rb") as raw:
+                data = raw.read(sizes[month])
+        except FileNotFoundError:
+            # Подробности месяца свернуты в сводку после чтения состояния
+            return
+        with gzip.open(io.BytesIO(data), "rt", encoding="utf-8") as file:
+            for line in file:
+                event = json.loads(line)
+                yield event.pop("serial"), event
+
+    def iter_events(self, since=None, until=None):
+        """Перебирает архивные события в диапазоне [since, until).
+
+        Читаются только сегменты месяцев, пересекающихся с диапазоном.
+        """
+        sizes = self._load_state()["sizes"]
+        for month in self._months(sizes, since, until):
+            for serial_number, event in self._read_segment(month, sizes):
+                timestamp = event["timestamp"]
+                if since is not None and timestamp < since:
+                    continue
+                if until is not None and timestamp >= until:
+                    continue
+                yield serial_number, event
+
+    def iter_events_after(self, seq, since=None):
+        """Перебирает архивные события, добавленные в историю после seq.
+
+        У событий старых версий seq нет: они отбираются по метке времени
+        since, как раньше. Читаются только сегменты, где есть такие события.
+        """
+        state = self._load_state()
+        sizes, seqs = state["sizes"], state.get("seqs", {})
+        for month in sorted(sizes):
+            if seqs.get(month, 0) <= seq and (since is None or month < since[:MONTH_PREFIX]):
+                continue
+            for serial_number, event in self._read_segment(month, sizes):
+                if "seq" in event:
+                    if event["seq"] > seq:
+                        yield serial_number, event
+                elif since is not None and event["timestamp"] >= since:
+                    yield serial_number, event
+
+    def daily_summaries(self, since=None, until=None):
+        """Дневные сводки архива {серийный номер: {день: сводка}} за дни [since, until).
+
+        Для месяцев с подробными сегментами сводка считается по сегменту.
+        """
+        rolled_up = [os.path.basename(path)[:MONTH_PREFIX]
+                     for path in glob.glob(os.path.join(self.directory, "*.rollup.json"))]
+        sizes = self._load_state()["sizes"]
+        result = {}
+        for month in self._months(set(rolled_up) | set(sizes), since, until):
+            if month in sizes:
+                rollups = rollup_events(self._read_segment(month, sizes))
+            else:
+                with open(self._rollup_path(month), "r", encoding="utf-8") as file:
+                    rollups = json.load(file)
+            for serial_number, days in rollups.items():
+                for day, summary in days.items():
+                    if since is not None and day < since[:DAY_PREFIX]:
+                        continue
+                    if until is not None and day >= until[:DAY_PREFIX]:
+                        continue
+                    result.setdefault(serial_number, {})[day] = summary
+        return result
+
+    def rotate_log(self, log_file, max_bytes):
+        """Переносит текстовый лог в архив со сжатием, если он больше max_bytes.
+
+        :return: путь к архивной копии или None, если ротация не нужна
+        """
+        try:
+            if os.path.getsize(log_file) < max_bytes:
+                return None
+        except FileNotFoundError:
+            return None
+        base = os.path.splitext(os.path.basename(log_file))[0]
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        target = os.path.join(self.directory, f"{base}_{stamp}.log.gz")
+        with open(log_file, "rb") as source, gzip.open(target, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+        os.remove(log_file)
+        return target
+
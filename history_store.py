@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+
+
+class HistoryStore:
+    """Хранилище истории подключений: снимок + журнал только на добавление.
+
+    Каждое событие дописывается одной строкой JSON в журнал, поэтому
+    стоимость записи не зависит от размера истории. Фоновый поток
+    периодически делает fsync и сворачивает журнал в снимок.
+    Словарь `history` имеет прежний формат {серийный номер: [события]};
+    у событий, записанных этой версией, есть номер добавления "seq".
+
+    Если задан архив, при свертке события старше `retain_days` дней
+    переносятся в него и в снимок не попадают, поэтому размер снимка и
+    время запуска не зависят от срока работы. Подробности старше
+    `detail_days` дней архив сворачивает в дневные сводки.
+    """
+
+    def __init__(self, snapshot_path="history.json", journal_path="history.jsonl",
+                 fsync_batch=64, fsync_interval=1.0, compact_every=1000,
+                 archive=None, retain_days=None, detail_days=None, retention_interval=3600):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.archive = archive
+        self.retain_days = retain_days
+        self.detail_days = detail_days
+        self.retention_interval = retention_interval
+
+        self.history = {}
+        self._seq = 0
+        self._tail = []  # (seq, строка) записей журнала после последнего снимка
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        if self._load():
+            # Журнал оборван посреди записи: отрезаем поврежденный хвост
+            _write_atomic_lines(self.journal_path, (line for _, line in self._tail))
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._worker = threading.Thread(target=self._background, daemon=True)
+        self._worker.start()
+
+    def _load(self):
+        """Загружает снимок и проигрывает хвост журнала.
+
+        Возвращает True, если журнал оказался поврежден и его нужно обрезать.
+        """
+        self.history, self._seq, self._tail, truncated = _read(self.snapshot_path, self.journal_path)
+        return truncated
+
+    def append(self, serial_number, record):
+        """Добавляет событие в историю и дописывает его в журнал.
+
+        Событию присваивается номер seq — порядок добавления. Метка времени
+        может быть раньше уже записанных событий (подключение записывается
+        после сканирования), поэтому инкрементальный экспорт опирается на seq.
+        """
+        with self._lock:
+            self._seq += 1
+            event = {"seq": self._seq, **record}
+            line = json.dumps({"seq": self._seq, "serial": serial_number, **record}) + "\n"
+            self.history.setdefault(serial_number, []).append(event)
+            self._journal.write(line)
+            self._journal.flush()
+            self._tail.append((self._seq, line))
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch:
+                self._sync()
+
+    def _sync(self):
+        if self._unsynced:
+            os.fsync(self._journal.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _background(self):
+        # Первая проверка срока хранения — сразу после запуска
+        next_retention = time.monotonic()
+        while not self._stop.wait(self.fsync_interval):
+            with self._lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+                need_compact = len(self._tail) >= self.compact_every
+            if self._retention_cutoff() is not None and time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + self.retention_interval
+                need_compact = True
+            if need_compact:
+                self.compact()
+
+    def _retention_cutoff(self):
+        if self.archive is None or self.retain_days is None:
+            return None
+        return (datetime.now() - timedelta(days=self.retain_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def snapshot(self):
+        """Копия истории для чтения вне блокировки (экспорт, отображение)."""
+        with self._lock:
+            return {serial: list(events) for serial, events in self.history.items()}
+
+    def _apply_retention(self, history, cutoff):
+        """Переносит в архив события раньше cutoff и возвращает оставшуюся историю."""
+        archived_until = self.archive.archived_until
+        archived_seq = self.archive.last_seq
+        expired = []
+        kept = {}
+        for serial_number, events in history.items():
+            recent = []
+            for event in events:
+                if event["timestamp"] >= cutoff:
+                    recent.append(event)
+                elif "seq" in event:
+                    # Событие уже в архиве, если свертка прервалась до снимка; seq отличает
+                    # его от подключения, записанного позже со старым временем обнаружения
+                    if event["seq"] > archived_seq:
+                        expired.append((serial_number, event))
+                elif archived_until is None or event["timestamp"] >= archived_until:
+                    # Раньше archived_until событие уже в архиве: свертка прервалась до снимка
+                    expired.append((serial_number, event))
+            if recent:
+                kept[serial_number] = recent
+        if expired:
+            self.archive.archive(expired, cutoff)
+            metrics.counter("history_events_archived").inc(len(expired))
+        if self.detail_days is not None:
+            self.archive.expire_details(
+                (datetime.now() - timedelta(days=self.detail_days)).strftime("%Y-%m-%d %H:%M:%S"))
+        return kept
+
+    @metrics.timed("history_compact")
+    def compact(self):
+        """Сворачивает журнал в снимок и обрезает уже вошедшие в него записи."""
+        with self._compact_lock:
+            cutoff = self._retention_cutoff()
+            with self._lock:
+                seq = self._seq
+                history = {serial: list(events) for serial, events in self.history.items()}
+
+            if cutoff is not None:
+                history = self._apply_retention(history, cutoff)
+
+            # Снимок пишется вне блокировки, запись событий не ждет
+            _write_atomic(self.snapshot_path, {"seq": seq, "history": history})
+
+            with self._lock:
+                if cutoff is not None:
+                    # Новые события моложе cutoff, перенесенные уходят из памяти
+                    for serial in list(self.history):
+                        recent = [event for event in self.history[serial] if event["timestamp"] >= cutoff]
+                        if recent:
+                            self.history[serial] = recent
+                        else:
+                            del self.history[serial]
+                self._tail = [(s, line) for s, line in self._tail if s > seq]
+                self._journal.close()
+                _write_atomic_lines(self.journal_path, (line for _, line in self._tail))
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+                self._unsynced = 0
+
+    def close(self):
+        """Останавливает фоновый поток, сбрасывает журнал на диск и делает снимок."""
+        self._stop.set()
+        self._worker.join()
+        with self._lock:
+            self._sync()
+        self.compact()
+        self._journal.close()
+
+
+def _read(snapshot_path, journal_path):
+    """Читает снимок и записи журнала после него.
+
+    :return: (история, последний seq, хвост [(seq, строка)], оборван ли журнал)
+    """
+    snapshot_seq = 0
+    try:
+        with open(snapshot_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        data = {}
+    if set(data) == {"seq", "history"}:
+        snapshot_seq = data["seq"]
+        history = data["history"]
+    else:
+        # Старый формат history.json: просто словарь истории
+        history = data
+    seq = snapshot_seq
+    tail = []
+
+    try:
+        file = open(journal_path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return history, seq, tail, False
+    with file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Оборванная последняя строка после сбоя
+                return history, seq, tail, True
+            record_seq = record["seq"]
+            if record_seq <= snapshot_seq:
+                continue
+            serial_number = record.pop("serial")
+            history.setdefault(serial_number, []).append(record)
+            tail.append((record_seq, line if line.endswith("\n") else line + "\n"))
+            seq = record_seq
+    return history, seq, tail, False
+
+
+def load_history(snapshot_path="history.json", journal_path="history.jsonl"):
+    """Читает историю без записи в файлы и без фонового потока.
+
+    Для разовых задач (экспорт из командной строки), которые могут
+    работать параллельно с монитором, владеющим HistoryStore.
+    """
+    return _read(snapshot_path, journal_path)[0]
+
+
+def _write_atomic(filename, data):
+    tmp = filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, filename)
+
+
+def _write_atomic_lines(filename, lines):
+    tmp = filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        file.writelines(lines)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, filename)
@@ -0,0 +1,211 @@
+import abc
+import os
+import queue
+import select
+import socket
+import sys
+import threading
+import time
+
+# Протокол netlink для uevent ядра (в модуле socket константы нет)
+NETLINK_KOBJECT_UEVENT = 15
+
+
+def _drain(events, timeout):
+    """Ждет первое событие в очереди и забирает все накопившиеся без повторной блокировки."""
+    try:
+        result = [events.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while True:
+        try:
+            result.append(events.get_nowait())
+        except queue.Empty:
+            return result
+
+
+class HotplugSource(abc.ABC):
+    """Источник событий подключения и отключения носителей.
+
+    `wait` блокируется до изменения набора устройств или до истечения
+    таймаута и возвращает список событий (пустой при таймауте). Событие —
+    словарь с ключом "action" ("add", "remove" или "change") и, если
+    известно, "device".
+    """
+
+    @abc.abstractmethod
+    def wait(self, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class NetlinkSource(HotplugSource):
+    """События ядра (uevent) для блочных устройств через netlink, только Linux."""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        # Группа 1 — широковещательные uevent ядра
+        self._sock.bind((0, 1))
+
+    def wait(self, timeout=None):
+        events = []
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        while ready:
+            message = self._sock.recv(65536)
+            fields = dict(
+                field.split("=", 1)
+                for field in message.decode("utf-8", "replace").split("\0")
+                if "=" in field
+            )
+            if fields.get("SUBSYSTEM") == "block":
+                events.append({"action": fields.get("ACTION", "change"), "device": fields.get("DEVNAME")})
+            # Забираем всю пачку событий без повторной блокировки
+            ready, _, _ = select.select([self._sock], [], [], 0)
+        return events
+
+    def close(self):
+        self._sock.close()
+
+
+class MountsSource(HotplugSource):
+    """Изменения таблицы монтирования через poll() на /proc/self/mounts."""
+
+    def __init__(self, path="/proc/self/mounts"):
+        self._file = open(path, "r")
+        self._file.read()
+        self._poller = select.poll()
+        self._poller.register(self._file, select.POLLERR | select.POLLPRI)
+
+    def wait(self, timeout=None):
+        ready = self._poller.poll(None if timeout is None else timeout * 1000)
+        if not ready:
+            return []
+        # Перечитываем файл, иначе poll() будет сразу возвращать событие
+        self._file.seek(0)
+        self._file.read()
+        return [{"action": "change"}]
+
+    def close(self):
+        self._file.close()
+
+
+class WmiVolumeSource(HotplugSource):
+    """События Win32_VolumeChangeEvent через WMI, только Windows.
+
+    Объекты COM привязаны к потоку, в котором созданы, а COM нужно
+    инициализировать в каждом потоке. Поэтому наблюдатель WMI создается
+    и опрашивается в собственном потоке с CoInitialize, а `wait` только
+    читает очередь событий и может вызываться из любого потока, например
+    из пула asyncio.to_thread.
+    """
+
+    # Как долго поток наблюдателя ждет событие за раз; ограничивает задержку close
+    POLL_SLICE_MS = 500
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._watch, daemon=True, name="wmi-volume")
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+
+    def _watch(self):
+        import pythoncom
+        pythoncom.CoInitialize()
+        try:
+            try:
+                import wmi
+                watcher = wmi.WMI().watch_for(raw_wql="SELECT * FROM Win32_VolumeChangeEvent")
+            except Exception as e:
+                self._error = e
+                return
+            finally:
+                self._ready.set()
+            # EventType: 2 — подключение, 3 — отключение
+            actions = {2: "add", 3: "remove"}
+            while not self._stop.is_set():
+                try:
+                    event = watcher(timeout_ms=self.POLL_SLICE_MS)
+                except wmi.x_wmi_timed_out:
+                    continue
+                self._events.put({"action": actions.get(event.EventType, "change"), "device": event.DriveName})
+        finally:
+            pythoncom.CoUninitialize()
+
+    def wait(self, timeout=None):
+        return _drain(self._events, timeout)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class PollingSource(HotplugSource):
+    """Опрос дешевой функции `probe` с адаптивным интервалом.
+
+    Пока результат `probe` не меняется, интервал растет до `max_interval`;
+    после изменения снова опрашиваем часто.
+    """
+
+    def __init__(self, probe, min_interval=0.3, max_interval=5.0, factor=1.5):
+        self.probe = probe
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self._interval = min_interval
+        self._last = probe()
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self._interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return []
+            time.sleep(delay)
+            current = self.probe()
+            if current != self._last:
+                self._last = current
+                self._interval = self.min_interval
+                return [{"action": "change"}]
+            self._interval = min(self._interval * self.factor, self.max_interval)
+
+
+class FakeSource(HotplugSource):
+    """Ручной источник событий для проверки без реального оборудования."""
+
+    def __init__(self):
+        self._events = queue.Queue()
+
+    def emit(self, action="change", device=None):
+        self._events.put({"action": action, "device": device})
+
+    def wait(self, timeout=None):
+        return _drain(self._events, timeout)
+
+
+def open_hotplug_source(probe):
+    """Выбирает лучший доступный источник событий.
+
+    Linux: таблица монтирования, затем netlink; Windows: WMI. Если ни один
+    не доступен, используется опрос `probe` с адаптивным интервалом.
+    """
+    candidates = []
+    if sys.platform.startswith("linux"):
+        candidates = [MountsSource, NetlinkSource]
+    elif os.name == "nt":
+        candidates = [WmiVolumeSource]
+    for candidate in candidates:
+        try:
+            return candidate()
+        except Exception:
+            continue
+    return PollingSource(probe)
@@ -1,288 +1,478 @@
-import wmi
+import os
+import threading
 import time
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
-import json
 from datetime import datetime
-import pandas as pd
-import keyboard  
-import os
 
+import exports
+import metrics
+from walker import ScanCancelled, walk_files
 
-console = Console()
+@metrics.timed("get_removable_drives")
+def get_removable_drives(force=False):
+    """Возвращает (список носителей, отпечаток набора).
 
-def save_data(data, filename):
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4)
+    Полное перечисление только после изменения дешевой проверки бэкенда,
+    по событию hotplug (force) или по страховочному интервалу.
+    """
+    return get_drive_gate().poll(force)
 
-def load_data(filename):
-    try:
-        with open(filename, "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
+# Сколько дней события хранятся в памяти целиком; более старые уходят в архив
+HISTORY_RETAIN_DAYS = 90
+
+# Сколько дней архив хранит подробности; затем остаются только дневные сводки
+HISTORY_DETAIL_DAYS = 730
+
+# Размер файла file_changes_<serial>.log, после которого он сжимается в архив
+CHANGE_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+# Полный опрос носителей даже без событий, на случай пропущенного события
+HOTPLUG_SAFETY_INTERVAL = 30
+
+# Сколько носителей сканируется одновременно
+MAX_CONCURRENT_SCANS = 2
+
+# Как часто проверять завершенные сканирования, секунды
+SCAN_RESULTS_INTERVAL = 0.5
+
+# Частота перерисовки панели устройств, не зависит от опроса носителей
+DASHBOARD_REFRESH_PER_SECOND = 4
+
+# Сколько ждать текущий экспорт при завершении программы, секунды
+EXPORT_SHUTDOWN_TIMEOUT = 10
+
+# Как часто выводить сводку метрик в консоль, секунды
+METRICS_SUMMARY_INTERVAL = 300
+
+# Человекочитаемый лог изменений файлов; источник истины — манифест
+WRITE_CHANGE_LOG = True
+
+# Хэшировать новые и измененные файлы для поиска содержимого по всем носителям
+INDEX_FILE_CONTENTS = True
+
+# Сколько носителей хэшируется одновременно; индексирование идет после
+# сканирования и не задерживает запись подключения в историю
+MAX_CONCURRENT_INDEXING = 1
+
+# Тяжелые зависимости (rich, WMI) и файлы данных загружаются при первом
+# обращении, чтобы разовые команды (экспорт, сканирование) запускались быстро
+_lazy = {}
+_lazy_lock = threading.RLock()
 
+def _get(name, factory):
+    value = _lazy.get(name)
+    if value is None:
+        with _lazy_lock:
+            value = _lazy.get(name)
+            if value is None:
+                value = _lazy[name] = factory()
+    return value
 
-def _set(obj, attribute, value):
-    """Helper function to add an attribute directly into the instance
-    dictionary, bypassing possible `__getattr__` calls
+def _console():
+    from rich.console import Console
+    return Console()
 
-    :param obj: Any python object
-    :param attribute: String containing attribute name
-    :param value: Any python object
+def _owners():
+    from owner_registry import OwnerRegistry
+    return OwnerRegistry("owners.json")
+
+def _history_archive():
+    from history_archive import HistoryArchive
+    return HistoryArchive("history_archive")
+
+def _history_store():
+    from history_store import HistoryStore
+    return HistoryStore("history.json", "history.jsonl", archive=get_history_archive(),
+                        retain_days=HISTORY_RETAIN_DAYS, detail_days=HISTORY_DETAIL_DAYS)
+
+def _manifest():
+    from manifest import FileManifest
+    return FileManifest("file_manifest.db")
+
+def _content_index():
+    get_manifest()  # индекс читает таблицу манифеста
+    from content_index import ContentIndex
+    return ContentIndex("file_manifest.db")
+
+def _drive_gate():
+    from drives import GatedEnumerator, default_backend
+    return GatedEnumerator(default_backend(), HOTPLUG_SAFETY_INTERVAL)
+
+def get_console():
+    return _get("console", _console)
+
+def get_owners():
+    return _get("owners", _owners)
+
+def get_history_archive():
+    return _get("history_archive", _history_archive)
+
+def get_history_store():
+    return _get("history_store", _history_store)
+
+def get_manifest():
+    return _get("manifest", _manifest)
+
+def get_content_index():
+    return _get("content_index", _content_index)
+
+def get_drive_gate():
+    return _get("drive_gate", _drive_gate)
+
+_LAZY_ATTRIBUTES = {
+    "console": get_console,
+    "owners": get_owners,
+    "history_archive": get_history_archive,
+    "history_store": get_history_store,
+    # Только чтение: обращение к main.history не должно запускать писателя истории
+    "history": lambda: get_history_snapshot(),
+    "manifest": get_manifest,
+    "content_index": get_content_index,
+    "drive_gate": get_drive_gate,
+}
+
+def __getattr__(name):
+    # Прежние глобальные объекты модуля (main.history_store и т.п.) создаются при обращении
+    getter = _LAZY_ATTRIBUTES.get(name)
+    if getter is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getter()
+
+def get_history_snapshot():
+    """История для экспорта: из работающего хранилища или только чтением файлов.
+
+    Разовый экспорт не создает HistoryStore, поэтому не пишет в файлы
+    истории параллельно с запущенным монитором.
     """
-    obj.__dict__[attribute] = value
-    
-    
-def get_removable_drives():
-    c = wmi.WMI()
-    removable_drives = []
-        
-    for drive in c.Win32_DiskDrive():
-        
-        if drive.MediaType == "Removable Media" or drive.MediaType == "External hard disk media":
-            for partition in drive.associators("Win32_DiskDriveToDiskPartition"):
-                for logical_disk in partition.associators("Win32_LogicalDiskToPartition"):
-                    _set(drive,"Letter",logical_disk.DeviceID)
-                    removable_drives.append(drive) 
-
-    return removable_drives
-
-def get_drives_hash(drives):
-    return hash(tuple((drive.Model, drive.SerialNumber) for drive in drives))
-
-owners = load_data("owners.json")
-history = load_data("history.json")
+    store = _lazy.get("history_store")
+    if store is not None:
+        return store.snapshot()
+    from history_store import load_history
+    return load_history("history.json", "history.jsonl")
+
+def close_data():
+    """Закрывает созданные хранилища: журнал истории сбрасывается в снимок."""
+    for name in ("history_store", "content_index", "manifest"):
+        value = _lazy.pop(name, None)
+        if value is not None:
+            value.close()
 
 def get_owner(serial_number):
-    if serial_number not in owners:
-        owner = console.input(f"[yellow]Флеш-карта с серийным номером {serial_number} подключена впервые. Введите имя владельца: ")
-        owners[serial_number] = owner
-        save_data(owners, "owners.json")
-    return owners[serial_number]
-
-def update_history(serial_number, event, file_changes=None):
-    if serial_number not in history:
-        history[serial_number] = []
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    history[serial_number].append({
+    owner = get_owners().get(serial_number)
+    if owner is None:
+        owner = get_console().input(f"[yellow]Флеш-карта с серийным номером {serial_number} подключена впервые. Введите имя владельца: ")
+        get_owners().set(serial_number, owner)
+    return owner
+
+def now_timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+@metrics.timed("update_history")
+def update_history(serial_number, event, file_changes=None, timestamp=None):
+    """Дописывает событие носителя в историю.
+
+    :param timestamp: время события; по умолчанию — текущее. Подключение
+        записывается после сканирования, поэтому его время передается явно
+    """
+    if timestamp is None:
+        timestamp = now_timestamp()
+    # Событие дописывается в журнал, history.json переписывается только при свертке
+    get_history_store().append(serial_number, {
         "event": event,
         "timestamp": timestamp,
         "file_changes": file_changes  # Добавляем информацию о файлах
     })
-    save_data(history, "history.json")
 
 
 def get_user_by_serial_number(serial_number):
-    users = load_data("owners.json")
-    try:
-        return users[serial_number]
-    except Exception:
+    # Реестр перечитывает owners.json только при изменении файла
+    return get_owners().get(serial_number)
+
+def scan_files_on_drive(drive_letter, cancel=None):
+    """Сканирует файлы на съемном носителе.
+
+    Генератор кортежей (путь, размер, mtime_ns); путь — относительно корня
+    носителя, чтобы манифест не зависел от буквы диска или точки монтирования.
+    Список путей в памяти не строится. Недоступные каталоги пропускаются
+    с сообщением в консоль.
+    """
+    def on_error(path, error):
+        get_console().print(f"[red]Не удалось прочитать {path}: {error}")
+
+    # walk_files строит пути как os.path.join(каталог, имя), поэтому корень просто отрезается
+    prefix = len(os.path.join(drive_letter, ""))
+    count = 0
+    # Время считается до конца обхода, включая обработку потребителем
+    with metrics.time_block("scan_files_on_drive"):
+        for filepath, stat in walk_files(drive_letter, cancel=cancel, on_error=on_error):
+            count += 1
+            yield filepath[prefix:], stat.st_size, stat.st_mtime_ns
+    metrics.counter("scanned_files").inc(count)
+
+
+def write_change_log(log_file, file_changes):
+    """Дописывает изменения в человекочитаемый лог file_changes_<serial>.log."""
+    get_history_archive().rotate_log(log_file, CHANGE_LOG_MAX_BYTES)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with open(log_file, "a", encoding="utf-8") as file:
+        for filepath in file_changes["new_files"]:
+            file.write(f"{timestamp} - Добавлен: {filepath}\n")
+        for filepath in file_changes["modified_files"]:
+            file.write(f"{timestamp} - Изменен: {filepath}\n")
+        for filepath in file_changes["removed_files"]:
+            file.write(f"{timestamp} - Удален: {filepath}\n")
+
+
+def log_file_changes(serial_number, drive_letter, cancel=None):
+    """Логирует изменения файлов на съемном носителе.
+
+    Содержимое файлов здесь не читается: индекс содержимого обновляет
+    отдельная задача index_drive_contents после записи подключения.
+
+    :raises ScanCancelled: если носитель извлечен во время сканирования;
+        манифест в этом случае не меняется
+    """
+    log_file = f"file_changes_{serial_number}.log"
+    first_scan = not get_manifest().known(serial_number)
+
+    if first_scan and os.path.exists(log_file):
+        # Носитель сканировался старой версией: переносим список файлов из лога
+        get_manifest().import_legacy_log(serial_number, log_file, drive_letter)
+        first_scan = False
+
+    # Сканирование потоком уходит во временную таблицу SQLite, сравнение
+    # с предыдущим состоянием выполняется там же, а не в памяти
+    file_changes = get_manifest().update(serial_number, scan_files_on_drive(drive_letter, cancel), drive_letter)
+
+    if WRITE_CHANGE_LOG:
+        write_change_log(log_file, file_changes)
+
+    if first_scan:
+        # При первом подключении все файлы считаются исходным состоянием
         return None
+    return file_changes
 
-def scan_files_on_drive(drive_letter):
-    """Сканирует файлы на съемном носителе."""
-    files = []
-    for root, _, filenames in os.walk(drive_letter):
-        for filename in filenames:
-            files.append(os.path.join(root, filename))
-    return files
+def index_drive_contents(serial_number, drive_letter, cancel=None):
+    """Хэширует файлы носителя без хэша в манифесте и обновляет индекс содержимого.
 
+    Если носитель извлекли, посчитанная часть сохраняется, остальное
+    хэшируется при следующем подключении.
 
-def log_file_changes(serial_number, drive_letter):
-    """Логирует изменения файлов на съемном носителе."""
-    log_file = f"file_changes_{serial_number}.log"
-    current_files = set(scan_files_on_drive(drive_letter))
-
-    if not os.path.exists(log_file):
-        # Если файл лога не существует, создаем его и записываем текущие файлы
-        with open(log_file, "w", encoding="utf-8") as file:
-            for filepath in current_files:
-                file.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Добавлен: {filepath}\n")
-    else:
-        # Читаем предыдущий список файлов
-        previous_files = set()
-        with open(log_file, "r", encoding="utf-8") as file:
-            for line in file:
-                if "Добавлен:" in line:
-                    previous_files.add(line.split("Добавлен: ")[1].strip())
-
-        # Находим новые, измененные и удаленные файлы
-        new_files = current_files - previous_files
-        removed_files = previous_files - current_files
-
-        # Записываем новые файлы в лог
-        with open(log_file, "a", encoding="utf-8") as file:
-            for filepath in new_files:
-                file.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Добавлен: {filepath}\n")
-            for filepath in removed_files:
-                file.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Удален: {filepath}\n")
-
-        # Возвращаем изменения файлов
-        return {
-            "new_files": list(new_files),
-            "removed_files": list(removed_files)
-        }
-
-def export_to_timeline_html():
-    # Создаем HTML-файл с временной линией
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Timeline of USB Connections</title>
-        <style>
-            /* Ваши стили для timeline */
-        </style>
-    </head>
-    <body>
-        <div class="timeline">
+    :return: число прочитанных файлов
     """
+    return get_content_index().update(serial_number, drive_letter, cancel)
 
-    # Добавляем события в timeline
-    for serial_number, events in history.items():
-        owner = get_user_by_serial_number(serial_number)
-        for event in events:
-            timestamp = event["timestamp"]
-            event_type = event["event"]
-            file_changes = event.get("file_changes", {})
-            html_content += f"""
-            <div class="container {'left' if event_type == 'подключен' else 'right'}">
-                <div class="content">
-                    <h2>{timestamp}</h2>
-                    <p><strong>Владелец:</strong> {owner}</p>
-                    <p><strong>Серийный номер:</strong> {serial_number}</p>
-                    <p><strong>Событие:</strong> {event_type}</p>
-                    <p><strong>Изменения файлов:</strong></p>
-                    <ul>
-                        {"".join(f"<li>Добавлен: {file}</li>" for file in file_changes.get("new_files", []))}
-                        {"".join(f"<li>Удален: {file}</li>" for file in file_changes.get("removed_files", []))}
-                    </ul>
-                </div>
-            </div>
-            """
-
-    html_content += """
-        </div>
-    </body>
-    </html>
-    """
+@metrics.timed("export_timeline_html")
+def export_to_timeline_html(since=None, until=None, split_by=None, progress=None, filename="timeline.html"):
+    # Один снимок владельцев на весь экспорт, а не чтение файла на каждое событие
+    files = exports.export_to_timeline_html(get_history_snapshot(), get_owners().as_dict(), filename,
+                                            since=since, until=until, split_by=split_by,
+                                            archive=get_history_archive(), progress=progress)
 
-    # Сохраняем HTML-файл
-    with open("timeline.html", "w", encoding="utf-8") as file:
-        file.write(html_content)
-
-    console.print("[green]Данные успешно экспортированы в файл 'timeline.html'.")
-    
-def export_to_excel():
-    owners_df = pd.DataFrame(list(owners.items()), columns=["Серийный номер", "Владелец"])
-
-    history_data = []
-    for serial_number, events in history.items():
-        for event in events:
-            file_changes = event.get("file_changes", {})
-            history_data.append({
-                "Владелец": get_user_by_serial_number(serial_number),
-                "Серийный номер": serial_number,
-                "Событие": event["event"],
-                "Время": event["timestamp"],
-                "Добавленные файлы": ", ".join(file_changes.get("new_files", [])),
-                "Удаленные файлы": ", ".join(file_changes.get("removed_files", []))
-            })
-    history_df = pd.DataFrame(history_data)
-
-    with pd.ExcelWriter("подключения_и_пользователи.xlsx") as writer:
-        owners_df.to_excel(writer, sheet_name="Владельцы", index=False)
-        history_df.to_excel(writer, sheet_name="История подключений", index=False)
-
-    console.print("[green]Данные успешно экспортированы в файл 'подключения_и_пользователи.xlsx'.")
-
-    with pd.ExcelWriter("подключения_и_пользователи.xlsx") as writer:
-        owners_df.to_excel(writer, sheet_name="Владельцы", index=False)
-        history_df.to_excel(writer, sheet_name="История подключений", index=False)
-
-    console.print("[green]Данные успешно экспортированы в файл 'подключения_и_пользователи.xlsx'.")
+    return f"Данные успешно экспортированы в файл '{', '.join(files)}'."
 
-if __name__ == "__main__":
+@metrics.timed("export_history")
+def export_to_excel(fmt="xlsx", incremental=False, progress=None, filename=None):
+    # Один снимок владельцев на весь экспорт, а не чтение файла на каждую строку
+    path, count = exports.export_history(get_history_snapshot(), get_owners().as_dict(),
+                                         filename or f"подключения_и_пользователи.{fmt}", fmt, incremental,
+                                         archive=get_history_archive(), progress=progress)
+
+    return f"Данные успешно экспортированы в файл '{path}' (строк: {count})."
+
+@metrics.timed("export_daily_summary")
+def export_daily_summary(since=None, until=None, filename="сводка_по_дням.csv"):
+    count = exports.export_daily_summary(get_history_snapshot(), get_owners().as_dict(), filename,
+                                         since=since, until=until, archive=get_history_archive())
+
+    return f"Данные успешно экспортированы в файл '{filename}' (строк: {count})."
+
+EXPORT_JOBS = {
+    "excel": ("Экспорт в Excel", lambda progress: export_to_excel(progress=progress)),
+    "timeline": ("Экспорт в timeline.html", lambda progress: export_to_timeline_html(progress=progress)),
+}
+
+DASHBOARD_HEADER = ["[cyan]Нажмите '1' для экспорта данных в Excel.",
+                    "[cyan]Нажмите '2' для экспорта данных в timeline.html.",
+                    "[cyan]Нажмите Ctrl+C для завершения программы."]
+
+def _pop_first(timestamps, serial):
+    pending = timestamps.get(serial)
+    if not pending:
+        return None
+    timestamp = pending.pop(0)
+    if not pending:
+        del timestamps[serial]
+    return timestamp
+
+
+def apply_scan_results(scan_jobs, index_jobs, drive_paths, connected, disconnected):
+    """Записывает в историю подключения, сканирование которых завершилось.
+
+    Результат отмененного сканирования тоже записывается: изменения, которые
+    задача успела сохранить в манифест, иначе не попали бы в историю.
+    Отключение носителя записывается после его подключения.
+
+    :param scan_jobs: ScanScheduler сканирований
+    :param index_jobs: ScanScheduler индексирования содержимого
+    :param drive_paths: словарь {серийный номер: путь} подключенных носителей
+    :param connected: словарь {серийный номер: [время подключения]} для
+        поставленных сканирований; обновляется на месте
+    :param disconnected: словарь {серийный номер: [время отключения]}, ждущих
+        результата сканирования; обновляется на месте
+    """
+    finished = scan_jobs.completed()
+    for serial, file_changes, error in finished:
+        if error is not None and not isinstance(error, ScanCancelled):
+            get_console().print(f"[red]Ошибка при сканировании устройства {serial}: {error}")
+        # Время подключения — когда носитель обнаружен, а не когда закончилось сканирование
+        update_history(serial, "подключен", file_changes, timestamp=_pop_first(connected, serial))
+        if disconnected.get(serial):
+            update_history(serial, "отключен", timestamp=_pop_first(disconnected, serial))
+        elif INDEX_FILE_CONTENTS and error is None and serial in drive_paths:
+            # Манифест уже сохранен; хэширование идет отдельной задачей
+            index_jobs.submit(serial, drive_paths[serial])
+    for serial, _, error in index_jobs.completed():
+        if error is not None and not isinstance(error, ScanCancelled):
+            get_console().print(f"[red]Ошибка при индексировании устройства {serial}: {error}")
+    return bool(finished)
+
+
+def drive_rows(removable_drives, scan_jobs):
+    """Строки панели устройств: модель, серийный номер, владелец, сводка изменений."""
+    from dashboard import summarize_file_changes
+    rows = {}
+    for drive in removable_drives:
+        serial = drive["SerialNumber"]
+        if scan_jobs.is_scanning(serial):
+            file_changes_str = "Сканирование..."
+        else:
+            # Последнее событие устройства; списки файлов сворачиваются до счетчиков
+            device_history = get_history_store().history.get(serial) or []
+            file_changes = device_history[-1].get("file_changes") if device_history else None
+            file_changes_str = summarize_file_changes(file_changes)
+        rows[serial] = (drive["Model"], serial, str(get_owners().get(serial)), file_changes_str)
+    return rows
+
+
+def on_export_update(dashboard, export_jobs, kind, status, final):
+    """Показывает ход экспорта в заголовке панели, результат — в консоли."""
+    dashboard.set_header(DASHBOARD_HEADER + export_jobs.status_lines())
+    if final:
+        get_console().print(f"[green]{EXPORT_JOBS[kind][0]}: {status}")
+
+
+def run():
+    """Консольный монитор съемных носителей с живой панелью."""
+    import keyboard
+    from rich.panel import Panel
+    from dashboard import Dashboard
+    from export_jobs import ExportQueue
+    from hotplug import open_hotplug_source
+    from scan_jobs import ScanScheduler
+
+    # Сканирование носителей идет в пуле потоков и не блокирует основной цикл
+    scan_jobs = ScanScheduler(log_file_changes, max_workers=MAX_CONCURRENT_SCANS)
+    # Хэширование содержимого — отдельная очередь с меньшим числом потоков
+    index_jobs = ScanScheduler(index_drive_contents, max_workers=MAX_CONCURRENT_INDEXING, name="index")
+    # Панель перерисовывается по таймеру, основной цикл только обновляет строки
+    dashboard = Dashboard(
+        get_console(), "ПОДКЛЮЧЕННЫЕ СЪЕМНЫЕ НОСИТЕЛИ",
+        [("Модель", {"justify": "left"}), ("Серийный номер", {"justify": "left"}),
+         ("Владелец", {"justify": "left"}), ("Изменения файлов", {"justify": "left"})],
+        header=DASHBOARD_HEADER,
+        empty_message="Съемные носители не найдены.",
+        refresh_per_second=DASHBOARD_REFRESH_PER_SECOND)
+    dashboard.start()
+    # Экспорт выполняется в фоне; обработчики клавиш регистрируются один раз
+    # и только ставят задачу в очередь, не задерживая обнаружение носителей
+    export_jobs = ExportQueue(EXPORT_JOBS, on_update=lambda kind, status, final: on_export_update(
+        dashboard, export_jobs, kind, status, final))
+    try:
+        keyboard.on_press_key("1", lambda _: export_jobs.request("excel"))
+        keyboard.on_press_key("2", lambda _: export_jobs.request("timeline"))
+        hotkeys = True
+    except Exception as e:
+        # Нет доступа к устройствам ввода (Linux без прав root, сервер без клавиатуры)
+        get_console().print(f"[yellow]Горячие клавиши недоступны ({e!r}), экспорт: python cli.py export")
+        hotkeys = False
+    hotplug = None
+    # Время обнаружения носителей, чьи события ждут результата сканирования
+    connected = {}
+    disconnected = {}
     try:
+        # Хранилище истории — только в процессе монитора; экспорт берет его снимок
+        get_history_store()
         previous_hash = None
         connected_drives = set()
-
-
+        # Блокирующий источник событий вместо опроса каждые 0.3 секунды
+        # Без системных событий опрашивается только дешевая проверка бэкенда
+        hotplug = open_hotplug_source(get_drive_gate().probe)
+        last_summary = time.monotonic()
+        events = True
 
         while True:
-            removable_drives = get_removable_drives()
-            current_hash = get_drives_hash(removable_drives)
-            if current_hash != previous_hash:
-                console.clear()
-                
-                current_serials = {drive.SerialNumber for drive in removable_drives}
+            removable_drives, current_hash = get_removable_drives(force=bool(events))
+            drives_changed = current_hash != previous_hash
+            # Сначала забираем готовые результаты, чтобы подключение попало в историю раньше отключения
+            scans_finished = apply_scan_results(
+                scan_jobs, index_jobs, {drive["SerialNumber"]: drive["Letter"] for drive in removable_drives},
+                connected, disconnected)
+
+            if drives_changed:
+                detected_at = now_timestamp()
+                drives_by_serial = {drive["SerialNumber"]: drive for drive in removable_drives}
+                current_serials = set(drives_by_serial)
                 new_drives = current_serials - connected_drives
                 removed_drives = connected_drives - current_serials
 
                 for serial in new_drives:
-                    for removable_drive in removable_drives:
-                        if removable_drive.SerialNumber == serial:
-                            file_changes = log_file_changes(serial, removable_drive.Letter)
-                            update_history(serial, "подключен", file_changes)
+                    if get_owners().get(serial) is None:
+                        # Ввод с клавиатуры несовместим с живой панелью
+                        with dashboard.suspended():
+                            get_owner(serial)
+                    if scan_jobs.submit(serial, drives_by_serial[serial]["Letter"]):
+                        connected.setdefault(serial, []).append(detected_at)
 
                 for serial in removed_drives:
-                    update_history(serial, "отключен")
+                    # Посчитанные хэши сохраняются, остальные — при следующем подключении
+                    index_jobs.cancel(serial)
+                    if scan_jobs.cancel(serial):
+                        # Носитель извлекли до конца сканирования: отключение
+                        # записывается вместе с результатом задачи
+                        disconnected.setdefault(serial, []).append(detected_at)
+                    else:
+                        update_history(serial, "отключен", timestamp=detected_at)
 
                 connected_drives = current_serials
+                previous_hash = current_hash
 
-                if removable_drives:
-                            # Оработчик нажатия клавиши "1"
-                    keyboard.on_press_key("1", lambda _: export_to_excel())
-                    keyboard.on_press_key("2", lambda _: export_to_timeline_html())
-
-                    console.print("[cyan]Нажмите '1' для экспорта данных в Excel.")
-                    console.print("[cyan]Нажмите '2' для экспорта данных в timeline.html.")
-                    
-                    console.print("[cyan]Нажмите Ctrl+C для завершения программы.")
-                    table = Table(title="ПОДКЛЮЧЕННЫЕ СЪЕМНЫЕ НОСИТЕЛИ")
-                    table.add_column("Модель", justify="left")
-                    table.add_column("Серийный номер", justify="left")
-                    table.add_column("Владелец", justify="left")
-                    table.add_column("Изменения файлов", justify="left")
-                    
-                    for drive in removable_drives:
-                        owner = get_owner(drive.SerialNumber)
-                        try:
-                            # Получаем историю для текущего устройства
-                            device_history = history.get(drive.SerialNumber, [])
-
-                            # Проверяем, есть ли история для устройства
-                            if device_history:
-                                # Берем последнее событие и извлекаем изменения файлов
-                                file_changes = device_history[-1].get("file_changes", {})
-                                file_changes_str = "\n".join(
-                                    [f"Добавлен: {file}" for file in file_changes.get("new_files", [])] +
-                                    [f"Удален: {file}" for file in file_changes.get("removed_files", [])]
-                                )
-                            else:
-                                # Если история пуста, указываем, что изменений нет
-                                file_changes_str = "Нет изменений файлов"
-
-                            # Добавляем строку в таблицу
-                            table.add_row(drive.Model, drive.SerialNumber, owner, file_changes_str)
-                        except Exception as e:
-                            # Логируем ошибку, если что-то пошло не так
-                            console.print(f"[red]Ошибка при обработке устройства {drive.SerialNumber}: {e}")
-                        
-
-                    console.print(table)
-                else:
-                    console.print(Panel("Съемные носители не найдены.", style="red"))
+            if drives_changed or scans_finished:
+                dashboard.set_rows(drive_rows(removable_drives, scan_jobs))
 
-                previous_hash = current_hash
+            # Пока идут сканирования, просыпаемся чаще, чтобы показать результаты
+            events = hotplug.wait(timeout=SCAN_RESULTS_INTERVAL if scan_jobs.pending() else HOTPLUG_SAFETY_INTERVAL)
 
-            time.sleep(0.3)
+            if time.monotonic() - last_summary >= METRICS_SUMMARY_INTERVAL:
+                last_summary = time.monotonic()
+                get_console().print(Panel("\n".join(metrics.summary_lines()) or "Нет данных",
+                                    title="Метрики", style="dim"))
     except KeyboardInterrupt:
-        console.print("[red]Программа завершена.")
+        get_console().print("[red]Программа завершена.")
     finally:
-        keyboard.unhook_all()
\ No newline at end of file
+        if hotkeys:
+            keyboard.unhook_all()
+        if hotplug is not None:
+            hotplug.close()
+        if not export_jobs.close(timeout=EXPORT_SHUTDOWN_TIMEOUT):
+            get_console().print("[yellow]Экспорт не завершен: файл может быть неполным.")
+        dashboard.stop()
+        scan_jobs.shutdown()
+        index_jobs.shutdown()
+        # Подключения, сканирование которых прервано остановкой, записываются
+        # со временем обнаружения; индексирование уже не ставится
+        apply_scan_results(scan_jobs, index_jobs, {}, connected, disconnected)
+        close_data()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,11 +1,18 @@
-import multiprocessing
+import asyncio
 import os
 import time
 import sqlite3
 import json
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse
+import atexit
+import base64
+import gzip
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import uvicorn
+import metrics
+from event_stream import EventStream
 
 # База данных
 DB_PATH = "usb_log.db"
@@ -13,6 +20,9 @@ DB_PATH = "usb_log.db"
 def init_db():
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
+        # WAL: обработчики FastAPI читают, не блокируя фоновую запись событий.
+        # Режим переключается вне транзакции, до изменений схемы
+        cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute('''CREATE TABLE IF NOT EXISTS usb_events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp TEXT,
@@ -21,87 +31,433 @@ def init_db():
             owner TEXT,
             file_changes TEXT
         )''')
+        # Индексы под выборки API: сортировка по времени и точные фильтры
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usb_events_timestamp ON usb_events (timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usb_events_type ON usb_events (event_type, timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usb_events_device ON usb_events (device, timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usb_events_owner ON usb_events (owner, timestamp, id)")
+        # Сборщик: host, идентификатор агента и id события на рабочей станции;
+        # у локальных событий host пуст
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(usb_events)")}
+        if "host" not in columns:
+            cursor.execute("ALTER TABLE usb_events ADD COLUMN host TEXT")
+            cursor.execute("ALTER TABLE usb_events ADD COLUMN source_id INTEGER")
+        if "agent_id" not in columns:
+            cursor.execute("ALTER TABLE usb_events ADD COLUMN agent_id TEXT")
+            # События, принятые до появления agent_id, относятся к агенту без идентификатора
+            cursor.execute("UPDATE usb_events SET agent_id = '' WHERE host IS NOT NULL")
+            cursor.execute("DROP INDEX IF EXISTS idx_usb_events_source")
+        # Повторно присланные события отбрасываются по этому индексу
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_usb_events_agent "
+                       "ON usb_events (host, agent_id, source_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usb_events_host ON usb_events (host, timestamp, id)")
         conn.commit()
 
 # Функция мониторинга USB
-import psutil  # Используем psutil для обнаружения новых устройств
-
-def monitor_usb():
-    known_devices = set()
-    while True:
-        devices = {disk.device for disk in psutil.disk_partitions(all=True) if 'removable' in disk.opts}
-        added = devices - known_devices
-        removed = known_devices - devices
-        
-        for device in added:
-            log_event("connect", device, "Unknown", "{} подключен".format(device))
-        for device in removed:
-            log_event("disconnect", device, "Unknown", "{} отключен".format(device))
-        
-        known_devices = devices
-        time.sleep(2)
+from concurrent.futures import ThreadPoolExecutor
+
+from drives import GatedEnumerator, default_backend, init_backend_thread
+from hotplug import open_hotplug_source
+from owner_registry import OwnerRegistry
+
+# Полное перечисление носителей даже без событий, на случай пропущенного события
+HOTPLUG_SAFETY_INTERVAL = 30
+
+# Как долго поток ждет событие hotplug за один раз; ограничивает задержку остановки
+MONITOR_WAIT_SLICE = 1.0
+
+async def monitor_usb(source=None, drive_gate=None):
+    """Следит за подключением носителей; выполняется задачей asyncio в приложении.
+
+    Обнаружение то же, что у консольного монитора (drives.GatedEnumerator):
+    носители различаются по серийному номеру, полное перечисление идет
+    только после изменения дешевой проверки, события hotplug или по
+    страховочному интервалу. Бэкенд создается и опрашивается в одном
+    выделенном потоке: объекты WMI привязаны к потоку, где созданы.
+    Блокирующее ожидание события выполняется в пуле потоков.
+
+    :param source: источник событий hotplug; по умолчанию выбирается
+        автоматически и закрывается при остановке, для проверки без
+        оборудования можно передать FakeSource
+    :param drive_gate: GatedEnumerator; по умолчанию — над бэкендом платформы
+    """
+    loop = asyncio.get_running_loop()
+    drive_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drives", initializer=init_backend_thread)
+    own_source = source is None
+    waiting = None
+    try:
+        if drive_gate is None:
+            try:
+                drive_gate = await loop.run_in_executor(
+                    drive_thread, lambda: GatedEnumerator(default_backend(), HOTPLUG_SAFETY_INTERVAL))
+            except RuntimeError as e:
+                # Платформа без бэкенда: API и прием событий работают без мониторинга
+                print(f"Мониторинг носителей недоступен: {e}")
+                return
+        if own_source:
+            source = await asyncio.to_thread(open_hotplug_source, drive_gate.probe)
+        owners = OwnerRegistry("owners.json")
+        known_drives = {}
+        events = True
+        while True:
+            # Время одного опроса без ожидания события
+            with metrics.time_block("monitor_usb_poll"):
+                drives, _ = await loop.run_in_executor(drive_thread, drive_gate.poll, bool(events))
+                current = {drive["SerialNumber"]: drive for drive in drives}
+
+                for serial in current.keys() - known_drives.keys():
+                    drive = current[serial]
+                    log_event("connect", serial, owners.get(serial) or "Unknown",
+                              "{} ({}) подключен".format(drive["Model"], drive["Letter"]))
+                for serial in known_drives.keys() - current.keys():
+                    drive = known_drives[serial]
+                    log_event("disconnect", serial, owners.get(serial) or "Unknown",
+                              "{} ({}) отключен".format(drive["Model"], drive["Letter"]))
+
+                known_drives = current
+            waiting = asyncio.ensure_future(asyncio.to_thread(source.wait, MONITOR_WAIT_SLICE))
+            events = await asyncio.shield(waiting)
+    finally:
+        if own_source and source is not None:
+            # Отмена задачи не прерывает поток ожидания: источник закрывается после него
+            if waiting is not None:
+                await asyncio.wait({waiting})
+            await asyncio.to_thread(source.close)
+        drive_thread.shutdown(wait=False)
 
 # Логирование изменений файлов
-import hashlib
+from hashing import HashCache
+from walker import ScanCancelled
 
-def hash_file(filepath):
-    hasher = hashlib.md5()
-    with open(filepath, 'rb') as f:
-        hasher.update(f.read())
-    return hasher.hexdigest()
+# Сколько файлов хэшируется одновременно
+HASH_WORKERS = 4
 
 def monitor_files(device):
     file_hashes = {}
-    while os.path.exists(device):
-        current_files = {f: hash_file(os.path.join(device, f)) for f in os.listdir(device)}
-        
-        for f, h in current_files.items():
-            if f not in file_hashes:
-                log_event("file_added", device, "Unknown", f"Файл добавлен: {f}")
-            elif file_hashes[f] != h:
-                log_event("file_modified", device, "Unknown", f"Файл изменён: {f}")
-        
-        for f in file_hashes.keys() - current_files.keys():
-            log_event("file_deleted", device, "Unknown", f"Файл удалён: {f}")
-        
-        file_hashes = current_files
-        time.sleep(2)
+    hash_cache = HashCache()
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        while os.path.exists(device):
+            # Рекурсивный обход; перечитываются только изменившиеся файлы
+            try:
+                current_files = hash_cache.hash_tree(device, executor)
+            except ScanCancelled:
+                break
+
+            for f, h in current_files.items():
+                if f not in file_hashes:
+                    log_event("file_added", device, "Unknown", f"Файл добавлен: {f}")
+                elif file_hashes[f] != h:
+                    log_event("file_modified", device, "Unknown", f"Файл изменён: {f}")
+
+            for f in file_hashes.keys() - current_files.keys():
+                log_event("file_deleted", device, "Unknown", f"Файл удалён: {f}")
+
+            file_hashes = current_files
+            time.sleep(2)
 
 # Логирование событий
+from event_writer import EventWriter
+
+# Рассылка новых событий клиентам SSE и WebSocket
+event_stream = EventStream()
+
+_event_writer = None
+_event_writer_pid = None
 
+def get_event_writer():
+    """Возвращает общий для процесса писатель событий, создавая его при первом вызове."""
+    global _event_writer, _event_writer_pid
+    # После fork поток писателя родителя в дочернем процессе не работает
+    if _event_writer is None or _event_writer_pid != os.getpid():
+        _event_writer = EventWriter(DB_PATH, "usb_events",
+                                    ("timestamp", "event_type", "device", "owner", "file_changes"))
+        _event_writer_pid = os.getpid()
+        atexit.register(close_event_writer)
+    return _event_writer
+
+def close_event_writer():
+    global _event_writer
+    if _event_writer is not None and _event_writer_pid == os.getpid():
+        _event_writer.close()
+    _event_writer = None
+
+@metrics.timed("log_event")
 def log_event(event_type, device, owner, file_changes):
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO usb_events (timestamp, event_type, device, owner, file_changes) VALUES (?, ?, ?, ?, ?)",
-                       (timestamp, event_type, device, owner, file_changes))
-        conn.commit()
+    # Запись идет пачками в фоновом потоке с одним соединением
+    get_event_writer().put((timestamp, event_type, device, owner, file_changes))
+    # Подписчики /events получают событие сразу, без опроса базы
+    event_stream.publish({"timestamp": timestamp, "event_type": event_type, "device": device,
+                          "owner": owner, "file_changes": file_changes})
 
 # Веб-интерфейс
-app = FastAPI()
+
+# Режим сборщика: прием событий с рабочих станций через /ingest без локального мониторинга
+COLLECTOR_MODE = os.environ.get("USB_MONITOR_COLLECTOR") == "1"
+
+# Адрес сборщика, на который агент отправляет свои события; пусто — не отправлять
+COLLECTOR_URL = os.environ.get("USB_MONITOR_COLLECTOR_URL")
+
+# Запускать ли мониторинг носителей вместе с приложением
+MONITOR_ON_STARTUP = not COLLECTOR_MODE
+
+# Интервал комментария-пинга в SSE, чтобы прокси не закрывали соединение
+SSE_KEEPALIVE = 15
+
+@asynccontextmanager
+async def lifespan(app):
+    init_db()
+    event_stream.attach(asyncio.get_running_loop())
+    monitor_task = asyncio.create_task(monitor_usb()) if MONITOR_ON_STARTUP else None
+    uploader = None
+    if COLLECTOR_URL:
+        from uploader import EventUploader
+        uploader = EventUploader(DB_PATH, COLLECTOR_URL)
+        uploader.start()
+    try:
+        yield
+    finally:
+        if uploader is not None:
+            uploader.stop()
+        if monitor_task is not None:
+            monitor_task.cancel()
+            try:
+                await monitor_task
+            except asyncio.CancelledError:
+                pass
+        event_stream.detach()
+        # Сбрасываем очередь событий при остановке приложения
+        close_event_writer()
+
+app = FastAPI(lifespan=lifespan)
+
+# Размер страницы по умолчанию и максимальный
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(timestamp, event_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, event_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    # Проверяем типы до запроса: ошибка внутри потокового ответа оборвет уже начатый ответ
+    if not isinstance(timestamp, str) or not isinstance(event_id, int) or isinstance(event_id, bool):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    return timestamp, event_id
+
+def query_events(limit, cursor=None, event_type=None, device=None, owner=None, since=None, until=None,
+                 host=None):
+    """Строит запрос страницы событий от новых к старым.
+
+    Пагинация по ключу (timestamp, id): следующая страница начинается
+    строго после последней строки предыдущей, без OFFSET.
+    """
+    conditions = []
+    params = []
+    for column, value in (("event_type", event_type), ("device", device), ("owner", owner), ("host", host)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if cursor is not None:
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    query = (f"SELECT id, timestamp, event_type, device, owner, file_changes, host FROM usb_events {where}"
+             "ORDER BY timestamp DESC, id DESC LIMIT ?")
+    params.append(limit)
+    return query, params
+
+def stream_events(query, params, limit):
+    """Отдает JSON по строкам, не собирая весь результат в памяти."""
+    # Генератор обходится из пула потоков Starlette, поток может меняться
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    try:
+        yield '{"events": ['
+        last = None
+        count = 0
+        for row in conn.execute(query, params):
+            yield ("," if count else "") + json.dumps(row)
+            last = row
+            count += 1
+        next_cursor = encode_cursor(last[1], last[0]) if last is not None and count == limit else None
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+    finally:
+        conn.close()
+
+def events_response(limit, cursor, event_type, device, owner, since, until, host=None):
+    query, params = query_events(limit, cursor, event_type, device, owner, since, until, host)
+    return StreamingResponse(stream_events(query, params, limit), media_type="application/json")
 
 @app.get("/")
-def index():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM usb_events ORDER BY timestamp DESC")
-    events = cursor.fetchall()
-    conn.close()
-    return JSONResponse(content={"events": events})
+def index(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+          cursor: Optional[str] = None,
+          since: Optional[str] = None,
+          until: Optional[str] = None):
+    return events_response(limit, cursor, None, None, None, since, until)
 
 @app.get("/filter")
-def filter_events(event_type: str = Query("", alias="event_type")):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    query = "SELECT * FROM usb_events WHERE event_type LIKE ? ORDER BY timestamp DESC"
-    cursor.execute(query, (f"%{event_type}%",))
-    events = cursor.fetchall()
-    conn.close()
-    return JSONResponse(content={"events": events})
+def filter_events(event_type: Optional[str] = Query(None, alias="event_type"),
+                  device: Optional[str] = None,
+                  owner: Optional[str] = None,
+                  host: Optional[str] = None,
+                  since: Optional[str] = None,
+                  until: Optional[str] = None,
+                  limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                  cursor: Optional[str] = None):
+    """Точные фильтры по типу события, устройству, владельцу и рабочей станции, диапазон времени [since, until)."""
+    return events_response(limit, cursor, event_type, device, owner, since, until, host)
+
+# Сколько событий сборщик принимает в одном запросе
+MAX_INGEST_BATCH = 50000
+
+def valid_ingest_event(event):
+    """Событие агента: [source_id, timestamp, event_type, device, owner, file_changes].
+
+    source_id — целое число: с NULL уникальный индекс не отбросит повтор.
+    Остальные поля — строки или null.
+    """
+    if not isinstance(event, list) or len(event) != 6:
+        return False
+    source_id = event[0]
+    if not isinstance(source_id, int) or isinstance(source_id, bool):
+        return False
+    return all(field is None or isinstance(field, str) for field in event[1:])
+
+def ingest_events(host, agent_id, events):
+    """Записывает пачку событий рабочей станции одной транзакцией.
+
+    :param events: список [source_id, timestamp, event_type, device, owner, file_changes]
+    :return: число новых событий; уже принятые раньше пропускаются
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO usb_events "
+                "(host, agent_id, source_id, timestamp, event_type, device, owner, file_changes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((host, agent_id, *event) for event in events))
+            return conn.total_changes - before
+    finally:
+        conn.close()
+
+@app.post("/ingest")
+async def ingest(request: Request):
+    """Прием пачки событий с агента: JSON {"host", "agent_id", "events"}, допускается gzip."""
+    if not COLLECTOR_MODE:
+        raise HTTPException(status_code=404, detail="Режим сборщика выключен")
+    body = await request.body()
+    try:
+        if request.headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+        host = payload["host"]
+        # Агенты без идентификатора (старые версии) различаются только по host
+        agent_id = payload.get("agent_id", "")
+        events = payload["events"]
+        if not isinstance(host, str) or not isinstance(agent_id, str) \
+                or not isinstance(events, list) or len(events) > MAX_INGEST_BATCH \
+                or not all(valid_ingest_event(event) for event in events):
+            raise ValueError("неверный формат")
+    except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Некорректная пачка событий: {e}")
+    with metrics.time_block("ingest_batch"):
+        inserted = await asyncio.to_thread(ingest_events, host, agent_id, events)
+    metrics.counter("events_ingested").inc(inserted)
+    return {"received": len(events), "inserted": inserted}
+
+# Индекс содержимого заполняется сканированиями консольного монитора (main.py)
+CONTENT_INDEX_PATH = "file_manifest.db"
+
+_content_index = None
+
+def get_content_index():
+    global _content_index
+    if _content_index is None:
+        from content_index import ContentIndex
+        _content_index = ContentIndex(CONTENT_INDEX_PATH)
+    return _content_index
+
+@app.get("/content/hash/{digest}")
+def content_by_hash(digest: str):
+    """На каких носителях и когда встречалось содержимое с этим MD5."""
+    return {"hash": digest, "locations": get_content_index().find_by_hash(digest)}
+
+@app.get("/content/name/{name}")
+def content_by_name(name: str):
+    """На каких носителях и когда встречался файл с этим именем."""
+    return {"name": name, "locations": get_content_index().find_by_name(name)}
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Метрики горячих путей в текстовом формате Prometheus."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/events/stream")
+async def events_stream(request: Request):
+    """Server-Sent Events: каждое новое событие отправляется сразу после записи."""
+    subscriber = event_stream.subscribe()
+
+    async def generate():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                dropped = subscriber.take_dropped()
+                if dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'count': dropped})}\n\n"
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            event_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/events/ws")
+async def events_ws(websocket: WebSocket):
+    """WebSocket с теми же событиями, что и /events/stream."""
+    await websocket.accept()
+    subscriber = event_stream.subscribe()
+    try:
+        while True:
+            event = await subscriber.queue.get()
+            dropped = subscriber.take_dropped()
+            if dropped:
+                await websocket.send_json({"event_type": "dropped", "count": dropped})
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_stream.unsubscribe(subscriber)
+
+def run(host="0.0.0.0", port=5000, db_path=None, collector=None, collector_url=None):
+    """Запускает веб-интерфейс; параметры переопределяют настройки модуля."""
+    global DB_PATH, COLLECTOR_MODE, MONITOR_ON_STARTUP, COLLECTOR_URL
+    if db_path is not None:
+        DB_PATH = db_path
+    if collector is not None:
+        COLLECTOR_MODE = collector
+        MONITOR_ON_STARTUP = not collector
+    if collector_url is not None:
+        COLLECTOR_URL = collector_url
+    # База, мониторинг и рассылка событий запускаются в lifespan приложения
+    uvicorn.run(app, host=host, port=port)
 
 if __name__ == "__main__":
-    init_db()
-    usb_monitor = multiprocessing.Process(target=monitor_usb)
-    usb_monitor.start()
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    run()
 
@@ -1,152 +1,96 @@
-import wmi
 import multiprocessing as mp
 from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
 from time import sleep
+from owner_registry import OwnerRegistry
+from state_bus import StateBus
+from drives import GatedEnumerator, default_backend
+from dashboard import Dashboard
 
 process = True
 
-def _set(obj, attribute, value):
-    """Helper function to add an attribute directly into the instance
-    dictionary, bypassing possible `__getattr__` calls
-
-    :param obj: Any python object
-    :param attribute: String containing attribute name
-    :param value: Any python object
-    """
-    obj.__dict__[attribute] = value
-
-
-def get_removable_drives(queue):
-    """Функция для получения съемных дисков и помещения их в очередь."""
+def get_removable_drives(bus):
+    """Функция для получения съемных дисков и публикации изменений в шину состояния."""
+    # Свой экземпляр реестра в процессе; изменения других процессов видны по mtime файла
+    owners = OwnerRegistry("owners.json")
+    # Одно соединение и кэш топологии на весь срок работы процесса; полное
+    # перечисление только после изменения дешевой проверки или раз в 30 секунд
+    drive_gate = GatedEnumerator(default_backend(), safety_interval=30)
     while process:
         try:
-            c = wmi.WMI()
-            removable_drives = []
-
-            for drive in c.Win32_DiskDrive():
-                if drive.MediaType == "Removable Media" or drive.MediaType == "External hard disk media":
-                    for partition in drive.associators("Win32_DiskDriveToDiskPartition"):
-                        for logical_disk in partition.associators("Win32_LogicalDiskToPartition"):
-                            drive_info = {
-                                "BytesPerSector": drive.BytesPerSector,
-                                "Capabilities": drive.Capabilities,
-                                "CapabilityDescriptions": drive.CapabilityDescriptions,
-                                "Caption": drive.Caption,
-                                "ConfigManagerErrorCode": drive.ConfigManagerErrorCode,
-                                "ConfigManagerUserConfig": drive.ConfigManagerUserConfig,
-                                "CreationClassName": drive.CreationClassName,
-                                "Description": drive.Description,
-                                "DeviceID": drive.DeviceID,
-                                "FirmwareRevision": drive.FirmwareRevision,
-                                "Index": drive.Index,
-                                "InterfaceType": drive.InterfaceType,
-                                "Manufacturer": drive.Manufacturer,
-                                "MediaLoaded": drive.MediaLoaded,
-                                "MediaType": drive.MediaType,
-                                "Model": drive.Model,
-                                "Name": drive.Name,
-                                "Partitions": drive.Partitions,
-                                "PNPDeviceID": drive.PNPDeviceID,
-                                "SCSIBus": drive.SCSIBus,
-                                "SCSILogicalUnit": drive.SCSILogicalUnit,
-                                "SCSIPort": drive.SCSIPort,
-                                "SCSITargetId": drive.SCSITargetId,
-                                "SectorsPerTrack": drive.SectorsPerTrack,
-                                "SerialNumber": drive.SerialNumber,
-                                "Signature": drive.Signature,
-                                "Size": drive.Size,
-                                "Status": drive.Status,
-                                "SystemCreationClassName": drive.SystemCreationClassName,
-                                "SystemName": drive.SystemName,
-                                "TotalCylinders": drive.TotalCylinders,
-                                "TotalHeads": drive.TotalHeads,
-                                "TotalSectors": drive.TotalSectors,
-                                "TotalTracks": drive.TotalTracks,
-                                "TracksPerCylinder": drive.TracksPerCylinder,
-                                "Letter": logical_disk.DeviceID,
-                                "Owner": None  # Изначально владелец неизвестен
-                            }
-                            removable_drives.append(drive_info)
+            removable_drives = {}
+            for drive_info in drive_gate.poll()[0]:
+                drive_info["Owner"] = owners.get(drive_info["SerialNumber"])  # None, если владелец неизвестен
+                removable_drives[f"{drive_info['SerialNumber']}:{drive_info['Letter']}"] = drive_info
 
-            queue.put(removable_drives)
+            # В шину уходят только изменения; без изменений сообщений нет
+            bus.publish(removable_drives)
         except Exception as e:
+            # Последнее опубликованное состояние остается в силе
             print(f"An error occurred: {e}")
-            queue.put([])
         sleep(2)  # Обновление каждые 2 секунды
 
 
-def display_devices(queue):
+def display_devices(subscription):
     """Функция для отображения подключенных устройств с использованием Rich."""
     console = Console()
-
-    while process:
-        removable_drives = queue.get()
-        console.clear()
-
-        if removable_drives:
-            table = Table(title="Connected Removable Drives", show_header=True, header_style="bold magenta")
-            table.add_column("Letter", style="cyan")
-            table.add_column("Caption", style="green")
-            table.add_column("Size", style="yellow")
-            table.add_column("Owner", style="bold magenta")
-            table.add_column("Media Type", style="blue")
-            table.add_column("Status", style="red")
-
-            for drive in removable_drives:
-                table.add_row(
-                    drive["Letter"],
-                    drive["Caption"],
-                    str(drive["Size"]),
-                    drive["Owner"],
-                    drive["MediaType"],
-                    drive["Status"]
-                )
-
-            console.print(Panel.fit(table, title="Removable Drives", border_style="bold blue"))
-        else:
-            console.print(Panel.fit("No removable drives found.", title="Removable Drives", border_style="bold red"))
+    dashboard = Dashboard(
+        console, "Connected Removable Drives",
+        [("Letter", {"style": "cyan"}), ("Caption", {"style": "green"}), ("Size", {"style": "yellow"}),
+         ("Owner", {"style": "bold magenta"}), ("Media Type", {"style": "blue"}), ("Status", {"style": "red"})],
+        empty_message="No removable drives found.",
+        show_header=True, header_style="bold magenta")
+    # Начинаем с полного снимка, дальше обновляем только изменившиеся строки
+    subscription.sync()
+
+    with dashboard:
+        while process:
+            dashboard.set_rows({
+                key: (drive["Letter"], drive["Caption"], str(drive["Size"]), str(drive["Owner"]),
+                      drive["MediaType"], drive["Status"])
+                for key, drive in subscription.state.items()
+            })
+            subscription.get()
 
 main_loop = True
 
-if __name__ == '__main__':
-    queue = mp.Queue()
+def run():
+    """Многопроцессный монитор: опрос, отображение и запрос владельцев в разных процессах."""
+    global process
+    bus = StateBus()
+    # Каждый потребитель получает свою подписку, сообщения не делятся между ними
+    display_subscription = bus.subscribe()
+    owner_subscription = bus.subscribe()
+    owners = OwnerRegistry("owners.json")
 
     # Запуск процесса для получения съемных дисков
-    processing_drives = mp.Process(target=get_removable_drives, args=(queue,))
+    processing_drives = mp.Process(target=get_removable_drives, args=(bus,))
     processing_drives.start()
 
     # Запуск процесса для отображения устройств
-    display_process = mp.Process(target=display_devices, args=(queue,))
+    display_process = mp.Process(target=display_devices, args=(display_subscription,))
     display_process.start()
 
     try:
         # Основной процесс остается активным
+        prompted = set()
         while main_loop:
-            removable_drives = queue.get()
+            owner_subscription.get()
 
             # Проверяем, есть ли устройства без владельца
-            unknown_owner_devices = [drive for drive in removable_drives if drive["Owner"] is None]
-
-            if unknown_owner_devices:
-                # Если есть устройства без владельца, запрашиваем ввод
-                main_loop = False
-                
-                for drive in unknown_owner_devices:
+            for drive in owner_subscription.state.values():
+                if drive["Owner"] is None and drive["SerialNumber"] not in prompted:
+                    prompted.add(drive["SerialNumber"])
                     owner = input(f"Введите имя владельца для устройства {drive['Letter']}: ")
-                    drive["Owner"] = owner  # Сохраняем введенное значение
-                    break
-            else:
-                True
-            # Отправляем обновленные данные обратно в очередь
-            queue.put(removable_drives)
-
-            sleep(1)
+                    # Процесс опроса увидит владельца в реестре и опубликует изменение
+                    owners.set(drive["SerialNumber"], owner)
     except KeyboardInterrupt:
         # Остановка процессов при завершении
         process = False
         processing_drives.terminate()
         display_process.terminate()
         processing_drives.join()
-        display_process.join()
\ No newline at end of file
+        display_process.join()
+
+
+if __name__ == '__main__':
+    run()
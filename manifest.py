@@ -0,0 +1,180 @@
+import os
+
+from sqlite_connections import ThreadConnections
+
+
+def relative_path(path, root):
+    """Путь относительно корня носителя: не зависит от буквы диска и точки монтирования.
+
+    Пути не из этого корня возвращаются без изменений; путь с буквой
+    другого диска (старый лог Windows) отрезается по букве.
+    """
+    prefix = os.path.join(root, "")
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    drive, rest = os.path.splitdrive(path)
+    if drive:
+        return rest.lstrip("\\/")
+    return path
+
+
+class FileManifest:
+    """Манифест файлов съемных носителей в SQLite.
+
+    Для каждого серийного номера хранится путь относительно корня носителя,
+    размер и время изменения файлов с последнего сканирования, а также хэш
+    содержимого (его заполняет ContentIndex; пока размер и mtime не
+    меняются, хэш сохраняется).
+    Сравнение нового сканирования с манифестом выполняется запросами по
+    индексу, без разбора текстового лога.
+
+    У каждого потока свое соединение и своя временная таблица, поэтому
+    несколько носителей сканируются параллельно; блокировка записи
+    берется только на время сравнения и обновления манифеста.
+    """
+
+    def __init__(self, db_path="file_manifest.db"):
+        self.db_path = db_path
+        self._connections = ThreadConnections(db_path, setup=self._create_scan_table)
+        conn = self._connection()
+        conn.execute('''CREATE TABLE IF NOT EXISTS drives (
+            serial TEXT PRIMARY KEY,
+            scanned_at TEXT,
+            relative INTEGER
+        )''')
+        if "relative" not in {row[1] for row in conn.execute("PRAGMA table_info(drives)")}:
+            # Манифест со старыми абсолютными путями переводится при следующем сканировании
+            conn.execute("ALTER TABLE drives ADD COLUMN relative INTEGER")
+        conn.execute('''CREATE TABLE IF NOT EXISTS manifest (
+            serial TEXT,
+            path TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            hash TEXT,
+            PRIMARY KEY (serial, path)
+        ) WITHOUT ROWID''')
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(manifest)")}
+        if "hash" not in columns:
+            # Манифест создан до появления индекса содержимого
+            conn.execute("ALTER TABLE manifest ADD COLUMN hash TEXT")
+
+    @staticmethod
+    def _create_scan_table(conn):
+        conn.execute('''CREATE TEMP TABLE IF NOT EXISTS scan (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER
+        ) WITHOUT ROWID''')
+
+    def _connection(self):
+        return self._connections.get()
+
+    def known(self, serial_number):
+        """Проверяет, сканировался ли носитель раньше."""
+        row = self._connection().execute("SELECT 1 FROM drives WHERE serial = ?", (serial_number,)).fetchone()
+        return row is not None
+
+    def import_legacy_log(self, serial_number, log_file, root):
+        """Переносит список файлов из старого file_changes_<serial>.log.
+
+        Размер и время изменения в старом логе неизвестны, поэтому такие
+        записи не считаются измененными при следующем сравнении. Абсолютные
+        пути лога переводятся в пути относительно `root`.
+        """
+        files = set()
+        with open(log_file, "r", encoding="utf-8") as file:
+            for line in file:
+                if "Добавлен: " in line:
+                    files.add(relative_path(line.split("Добавлен: ", 1)[1].rstrip("\n"), root))
+                elif "Удален: " in line:
+                    files.discard(relative_path(line.split("Удален: ", 1)[1].rstrip("\n"), root))
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO manifest (serial, path) VALUES (?, ?)",
+                             ((serial_number, path) for path in files))
+            conn.execute("INSERT OR REPLACE INTO drives VALUES (?, datetime('now', 'localtime'), 1)",
+                         (serial_number,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _migrate_paths(self, conn, serial_number, root):
+        """Переводит абсолютные пути старого манифеста в пути относительно root.
+
+        Хэши сохраняются, записи индекса содержимого переименовываются вместе
+        с манифестом. Пути, записанные с другой точкой монтирования, остаются
+        как есть и при сравнении один раз считаются удаленными.
+        """
+        row = conn.execute("SELECT relative FROM drives WHERE serial = ?", (serial_number,)).fetchone()
+        if row is None or row[0]:
+            return
+        prefix = os.path.join(root, "")
+        tables = ["manifest"]
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'content_locations'").fetchone():
+            tables.append("content_locations")
+        for table in tables:
+            conn.execute(f"UPDATE OR IGNORE {table} SET path = substr(path, ?) "
+                         f"WHERE serial = ? AND substr(path, 1, ?) = ?",
+                         (len(prefix) + 1, serial_number, len(prefix), prefix))
+
+    def update(self, serial_number, entries, root):
+        """Сравнивает сканирование с манифестом и сохраняет его как новое состояние.
+
+        :param entries: итерируемый набор кортежей (путь относительно root, размер, mtime_ns)
+        :param root: корень носителя; нужен для перевода манифеста старого формата
+        :return: словарь со списками new_files, removed_files и modified_files
+        """
+        conn = self._connection()
+
+        # Сканирование пишется только во временную таблицу: основная база не блокируется
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM scan")
+            conn.executemany("INSERT OR REPLACE INTO scan VALUES (?, ?, ?)", entries)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._migrate_paths(conn, serial_number, root)
+            new_files = [row[0] for row in conn.execute(
+                "SELECT s.path FROM scan s LEFT JOIN manifest m ON m.serial = ? AND m.path = s.path "
+                "WHERE m.path IS NULL", (serial_number,))]
+            removed_files = [row[0] for row in conn.execute(
+                "SELECT m.path FROM manifest m WHERE m.serial = ? "
+                "AND NOT EXISTS (SELECT 1 FROM scan s WHERE s.path = m.path)", (serial_number,))]
+            modified_files = [row[0] for row in conn.execute(
+                "SELECT s.path FROM scan s JOIN manifest m ON m.serial = ? AND m.path = s.path "
+                "WHERE m.size IS NOT NULL AND (m.size != s.size OR m.mtime_ns != s.mtime_ns)",
+                (serial_number,))]
+
+            conn.execute("DELETE FROM manifest WHERE serial = ? "
+                         "AND NOT EXISTS (SELECT 1 FROM scan s WHERE s.path = manifest.path)", (serial_number,))
+            # Хэш сохраняется только у файлов с прежними размером и mtime
+            conn.execute("INSERT INTO manifest (serial, path, size, mtime_ns) "
+                         "SELECT ?, path, size, mtime_ns FROM scan WHERE true "
+                         "ON CONFLICT (serial, path) DO UPDATE SET "
+                         "hash = CASE WHEN manifest.size = excluded.size "
+                         "AND manifest.mtime_ns = excluded.mtime_ns THEN manifest.hash END, "
+                         "size = excluded.size, mtime_ns = excluded.mtime_ns",
+                         (serial_number,))
+            conn.execute("INSERT OR REPLACE INTO drives VALUES (?, datetime('now', 'localtime'), 1)",
+                         (serial_number,))
+            conn.execute("DELETE FROM scan")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        return {
+            "new_files": new_files,
+            "removed_files": removed_files,
+            "modified_files": modified_files
+        }
+
+    def close(self):
+        self._connections.close()
@@ -0,0 +1,138 @@
+import functools
+import threading
+import time
+
+PREFIX = "usb_monitor_"
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Timer:
+    """Число вызовов, суммарное и максимальное время в секундах."""
+
+    __slots__ = ("count", "total", "max", "_lock")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+
+class _Timing:
+    __slots__ = ("timer", "start")
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """Набор счетчиков и таймеров.
+
+    Обновление — одно сложение под блокировкой; форматирование выполняется
+    только при чтении метрик.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name):
+        counter = self._counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(name, Counter())
+        return counter
+
+    def timer(self, name):
+        timer = self._timers.get(name)
+        if timer is None:
+            with self._lock:
+                timer = self._timers.setdefault(name, Timer())
+        return timer
+
+    def time(self, name):
+        """Контекстный менеджер, замеряющий время блока."""
+        return _Timing(self.timer(name))
+
+    def timed(self, name):
+        """Декоратор, замеряющий время вызова функции."""
+        def decorator(func):
+            timer = self.timer(name)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    timer.observe(time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self._counters.items()), sorted(self._timers.items())
+
+    def render_prometheus(self):
+        """Текстовый формат Prometheus для маршрута /metrics."""
+        counters, timers = self._snapshot()
+        lines = []
+        for name, counter in counters:
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            lines.append(f"{PREFIX}{name}_total {counter.value}")
+        for name, timer in timers:
+            metric = f"{PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {timer.count}")
+            lines.append(f"{metric}_sum {timer.total:.6f}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.append(f"{metric}_max {timer.max:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """Краткая сводка для консольного режима."""
+        counters, timers = self._snapshot()
+        lines = []
+        for name, timer in timers:
+            if timer.count:
+                lines.append(f"{name}: вызовов {timer.count}, среднее {timer.total / timer.count * 1000:.1f} мс, "
+                             f"максимум {timer.max * 1000:.1f} мс")
+        for name, counter in counters:
+            lines.append(f"{name}: {counter.value}")
+        return lines
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+render_prometheus = REGISTRY.render_prometheus
+summary_lines = REGISTRY.summary_lines
+time_block = REGISTRY.time
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+
+
+class OwnerRegistry:
+    """Реестр владельцев носителей поверх owners.json.
+
+    Словарь держится в памяти, поиск — O(1). Файл перечитывается только
+    если изменились его mtime или размер (проверка не чаще раза в
+    `revalidate_interval` секунд), поэтому несколько процессов видят
+    изменения друг друга без разбора файла на каждый запрос. Запись идет
+    через временный файл и os.replace под файловой блокировкой.
+    """
+
+    def __init__(self, path="owners.json", revalidate_interval=0.5):
+        self.path = path
+        self.revalidate_interval = revalidate_interval
+        self._owners = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._revalidate(force=True)
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _revalidate(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.revalidate_interval:
+            return
+        self._checked_at = now
+        signature = self._stat_signature()
+        if signature == self._signature and not force:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self._owners = json.load(file)
+        except FileNotFoundError:
+            self._owners = {}
+        except ValueError:
+            # Файл пишется другим процессом без os.replace: оставляем прежние данные
+            return
+        self._signature = signature
+
+    def get(self, serial_number, default=None):
+        with self._lock:
+            self._revalidate()
+            return self._owners.get(serial_number, default)
+
+    def __contains__(self, serial_number):
+        return self.get(serial_number) is not None
+
+    def __getitem__(self, serial_number):
+        owner = self.get(serial_number)
+        if owner is None:
+            raise KeyError(serial_number)
+        return owner
+
+    def as_dict(self):
+        """Снимок реестра, например для экспорта."""
+        with self._lock:
+            self._revalidate()
+            return dict(self._owners)
+
+    def set(self, serial_number, owner):
+        """Сохраняет владельца, объединяя с изменениями других процессов."""
+        with self._lock, _FileLock(self.path + ".lock"):
+            self._revalidate(force=True)
+            self._owners[serial_number] = owner
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as file:
+                json.dump(self._owners, file, indent=4)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.path)
+            self._signature = self._stat_signature()
+
+
+class _FileLock:
+    """Межпроцессная блокировка через эксклюзивное создание файла."""
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                if time.monotonic() >= deadline:
+                    # Блокировка осталась от упавшего процесса
+                    return self
+                time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,118 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from walker import ScanCancelled
+
+
+class ScanScheduler:
+    """Сканирование носителей в пуле потоков, по задаче на носитель.
+
+    Одновременно выполняется не больше `max_workers` задач, остальные ждут
+    в очереди пула, чтобы несколько больших носителей на одном хабе не
+    мешали друг другу. Результаты забираются из основного цикла через
+    `completed`, в том числе результаты отмененных задач: задача могла
+    успеть сохранить изменения до отмены, и они не должны потеряться.
+    """
+
+    def __init__(self, scan, max_workers=2, name="scan"):
+        """:param scan: функция (серийный номер, путь, cancel) -> результат
+        :param name: префикс имен потоков и метрики времени задачи
+        """
+        self._scan = scan
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = {}  # серийный номер -> событие отмены текущей задачи
+        self._outstanding = 0  # задачи, чей результат еще не забран
+        self._futures = {}  # событие отмены -> (серийный номер, путь, future) до получения результата
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+
+    def submit(self, serial_number, path):
+        """Ставит сканирование в очередь, если у носителя нет текущей задачи.
+
+        :return: False, если задача уже есть
+        """
+        with self._lock:
+            if serial_number in self._jobs:
+                return False
+            cancel = threading.Event()
+            self._jobs[serial_number] = cancel
+            self._outstanding += 1
+            # Под блокировкой: shutdown должен увидеть и задачу, еще не попавшую в пул
+            self._futures[cancel] = (serial_number, path,
+                                     self._executor.submit(self._run, serial_number, path, cancel))
+        return True
+
+    def _run(self, serial_number, path, cancel):
+        if cancel.is_set():
+            # Носитель извлекли, пока задача ждала в очереди
+            self._results.put((serial_number, cancel, None, ScanCancelled(path)))
+            return
+        try:
+            with metrics.time_block(f"{self.name}_job"):
+                result = self._scan(serial_number, path, cancel)
+            self._results.put((serial_number, cancel, result, None))
+        except Exception as e:
+            self._results.put((serial_number, cancel, None, e))
+
+    def cancel(self, serial_number):
+        """Отменяет задачу носителя; ее результат все равно вернет `completed`.
+
+        После отмены для носителя можно сразу поставить новую задачу.
+
+        :return: True, если задача была и ее результат еще не получен
+        """
+        with self._lock:
+            cancel = self._jobs.pop(serial_number, None)
+        if cancel is None:
+            return False
+        cancel.set()
+        metrics.counter(f"{self.name}_jobs_cancelled").inc()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return bool(self._outstanding)
+
+    def is_scanning(self, serial_number):
+        with self._lock:
+            return serial_number in self._jobs
+
+    def completed(self):
+        """Забирает готовые результаты без ожидания, в порядке завершения.
+
+        :return: список (серийный номер, результат, исключение или None);
+            отмененная задача, не успевшая закончить работу, возвращает ScanCancelled
+        """
+        finished = []
+        while True:
+            try:
+                serial_number, cancel, result, error = self._results.get_nowait()
+            except queue.Empty:
+                return finished
+            with self._lock:
+                self._outstanding -= 1
+                self._futures.pop(cancel, None)
+                if self._jobs.get(serial_number) is cancel:
+                    del self._jobs[serial_number]
+            finished.append((serial_number, result, error))
+
+    def shutdown(self):
+        """Отменяет все задачи и дожидается выполняющихся.
+
+        Результаты остаются доступны через `completed`: задачи, снятые из
+        очереди пула, возвращают ScanCancelled, как отмененные до запуска.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+        for cancel in jobs:
+            cancel.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            futures = list(self._futures.items())
+        for cancel, (serial_number, path, future) in futures:
+            if future.cancelled():
+                self._results.put((serial_number, cancel, None, ScanCancelled(path)))
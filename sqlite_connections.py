@@ -0,0 +1,40 @@
+import sqlite3
+import threading
+
+
+class ThreadConnections:
+    """Соединения SQLite по одному на поток, в режиме WAL.
+
+    Транзакции управляются явно (isolation_level=None); timeout — ожидание
+    записи другого потока или процесса. Все созданные соединения
+    запоминаются, чтобы `close` закрыл их из любого потока.
+    """
+
+    def __init__(self, db_path, setup=None, timeout=60):
+        """:param setup: функция (соединение), вызывается для каждого нового соединения"""
+        self.db_path = db_path
+        self._setup = setup
+        self._timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self._timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if self._setup is not None:
+                self._setup(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,105 @@
+import multiprocessing as mp
+import queue
+
+
+class StateBus:
+    """Шина состояния устройств с рассылкой изменений каждому подписчику.
+
+    Издатель передает полное состояние {ключ: данные устройства}, а по
+    очередям подписчиков уходят только изменения (added, removed, changed)
+    с монотонно растущим номером поколения. Если ничего не изменилось,
+    сообщений нет. Последний снимок хранится в менеджере, чтобы
+    подписчик, начавший читать позже, мог сначала получить полное состояние.
+
+    Очереди подписчиков и их список живут в менеджере, а издатель
+    перечитывает список при каждой публикации, поэтому подписаться можно
+    и после запуска процесса издателя. Подписка создается в процессе,
+    владеющем менеджером: в дочерние процессы передаются только прокси.
+    """
+
+    def __init__(self, manager=None):
+        self._manager = manager or mp.Manager()
+        self._snapshot = self._manager.dict(generation=0, state={})
+        self._queues = self._manager.list()
+        # Локальное состояние издателя
+        self._state = {}
+        self._generation = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Сам менеджер в дочерний процесс не передается, только прокси снимка
+        state["_manager"] = None
+        return state
+
+    def subscribe(self):
+        """Новая подписка; изменения приходят начиная со следующей публикации.
+
+        Подписчик, начавший позже, сначала вызывает `Subscription.sync`.
+        """
+        if self._manager is None:
+            raise RuntimeError("Подписка создается в процессе, где создана шина")
+        subscription_queue = self._manager.Queue()
+        self._queues.append(subscription_queue)
+        return Subscription(subscription_queue, self._snapshot)
+
+    def publish(self, state):
+        """Рассылает отличия `state` от предыдущего состояния.
+
+        :return: опубликованное изменение или None, если изменений нет
+        """
+        added = {key: value for key, value in state.items() if key not in self._state}
+        removed = [key for key in self._state if key not in state]
+        changed = {key: value for key, value in state.items()
+                   if key in self._state and self._state[key] != value}
+        if not (added or removed or changed):
+            return None
+
+        self._generation += 1
+        self._state = dict(state)
+        delta = {"generation": self._generation, "added": added, "removed": removed, "changed": changed}
+        # Сначала снимок, затем изменения: подписчик отбросит уже учтенные в снимке
+        self._snapshot.update(generation=self._generation, state=self._state)
+        # Список перечитывается каждый раз: подписчики могли добавиться после запуска издателя
+        for subscription_queue in list(self._queues):
+            subscription_queue.put(delta)
+        return delta
+
+
+class Subscription:
+    """Подписка на StateBus с локальной копией состояния."""
+
+    def __init__(self, subscription_queue, snapshot):
+        self._queue = subscription_queue
+        self._snapshot = snapshot
+        self.generation = 0
+        self.state = {}
+
+    def sync(self):
+        """Загружает полный снимок состояния."""
+        snapshot = self._snapshot.copy()
+        self.generation = snapshot["generation"]
+        self.state = dict(snapshot["state"])
+
+    def get(self, timeout=None):
+        """Ждет следующее изменение и применяет его к `state`.
+
+        :return: изменение или None при таймауте
+        """
+        while True:
+            try:
+                delta = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if delta["generation"] <= self.generation:
+                # Уже учтено в снимке
+                continue
+            if delta["generation"] != self.generation + 1:
+                # Пропуск поколений: берем полный снимок
+                self.sync()
+                return delta
+            for key in delta["removed"]:
+                self.state.pop(key, None)
+            self.state.update(delta["added"])
+            self.state.update(delta["changed"])
+            self.generation = delta["generation"]
+            return delta
@@ -0,0 +1,110 @@
+import gzip
+import json
+import random
+import socket
+import sqlite3
+import threading
+import urllib.request
+import uuid
+
+import metrics
+
+
+class EventUploader:
+    """Отправка локальных событий на сборщик пачками.
+
+    Буфером служит сама локальная таблица usb_events: отправляются строки
+    с id больше подтвержденного, отметка хранится в той же базе и
+    сдвигается только после ответа сборщика. Повторная отправка после
+    сбоя безопасна: сборщик отбрасывает события (host, agent_id, source_id),
+    которые уже видел. agent_id — случайный идентификатор, создаваемый один
+    раз вместе с отметкой: если локальную базу пересоздали и id событий
+    начались заново, или у двух машин одинаковое имя, их события не
+    совпадут с уже принятыми. При ошибке интервал повтора растет
+    экспоненциально.
+    """
+
+    def __init__(self, db_path, collector_url, host=None, batch_size=5000,
+                 poll_interval=1.0, min_backoff=1.0, max_backoff=60.0, timeout=30):
+        self.db_path = db_path
+        self.url = collector_url.rstrip("/") + "/ingest"
+        self.host = host or socket.gethostname()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS upload_state "
+                           "(collector TEXT PRIMARY KEY, last_id INTEGER, agent_id TEXT)")
+        if "agent_id" not in {row[1] for row in self._conn.execute("PRAGMA table_info(upload_state)")}:
+            self._conn.execute("ALTER TABLE upload_state ADD COLUMN agent_id TEXT")
+        # Отметка и идентификатор агента создаются вместе и живут в той же базе, что и события
+        self._conn.execute("INSERT OR IGNORE INTO upload_state VALUES (?, 0, ?)", (self.url, uuid.uuid4().hex))
+        self._conn.execute("UPDATE upload_state SET agent_id = ? WHERE collector = ? AND agent_id IS NULL",
+                           (uuid.uuid4().hex, self.url))
+        self._conn.commit()
+        self.agent_id = self._conn.execute("SELECT agent_id FROM upload_state WHERE collector = ?",
+                                           (self.url,)).fetchone()[0]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="uploader")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._conn.close()
+
+    def _last_id(self):
+        return self._conn.execute("SELECT last_id FROM upload_state WHERE collector = ?", (self.url,)).fetchone()[0]
+
+    def _batch(self, last_id):
+        return self._conn.execute(
+            "SELECT id, timestamp, event_type, device, owner, file_changes FROM usb_events "
+            "WHERE id > ? AND host IS NULL ORDER BY id LIMIT ?", (last_id, self.batch_size)).fetchall()
+
+    def _send(self, rows):
+        body = gzip.compress(json.dumps({"host": self.host, "agent_id": self.agent_id, "events": rows}).encode("utf-8"), compresslevel=1)
+        request = urllib.request.Request(self.url, data=body, method="POST", headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def upload_once(self):
+        """Отправляет одну пачку.
+
+        :return: число отправленных событий, 0 — если отправлять нечего
+        :raises OSError: если сборщик недоступен или вернул ошибку
+        """
+        last_id = self._last_id()
+        rows = self._batch(last_id)
+        if not rows:
+            return 0
+        with metrics.time_block("upload_batch"):
+            self._send(rows)
+        with self._conn:
+            self._conn.execute("UPDATE upload_state SET last_id = ? WHERE collector = ?", (rows[-1][0], self.url))
+        metrics.counter("events_uploaded").inc(len(rows))
+        return len(rows)
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stop.is_set():
+            try:
+                sent = self.upload_once()
+            except (OSError, ValueError, sqlite3.Error) as e:
+                # URLError и HTTPError из urllib — подклассы OSError
+                metrics.counter("upload_failures").inc()
+                print(f"Не удалось отправить события на {self.url}: {e}")
+                # Случайная добавка, чтобы агенты не повторяли запросы одновременно
+                self._stop.wait(backoff * random.uniform(1.0, 1.5))
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.min_backoff
+            if sent < self.batch_size:
+                # Очередь разобрана: ждем новых событий
+                self._stop.wait(self.poll_interval)
@@ -0,0 +1,43 @@
+import os
+
+
+class ScanCancelled(Exception):
+    """Сканирование прервано: носитель отключен или задача отменена."""
+
+
+def walk_files(root, cancel=None, on_error=None):
+    """Потоково обходит дерево через os.scandir.
+
+    Выдает пары (путь, stat) для каждого обычного файла; stat берется из
+    DirEntry, поэтому лишних системных вызовов нет. Обход не строит список
+    путей: в памяти хранятся только еще не обойденные каталоги.
+
+    :param cancel: threading.Event или None; установленное событие прерывает обход
+    :param on_error: функция (путь, исключение) для недоступных каталогов
+    :raises ScanCancelled: если обход отменен или корень носителя исчез
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if cancel is not None and cancel.is_set():
+                        raise ScanCancelled(root)
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, entry.stat(follow_symlinks=False)
+                    except OSError as e:
+                        _report(root, entry.path, e, on_error)
+        except OSError as e:
+            _report(root, directory, e, on_error)
+
+
+def _report(root, path, error, on_error):
+    if not os.path.exists(root):
+        # Ошибка из-за извлеченного носителя: дальше сканировать нечего
+        raise ScanCancelled(root) from error
+    if on_error is not None:
+        on_error(path, error)